@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def image_digest(image):
+    """计算归一化后像素内容的摘要"""
+    mode = 'RGBA' if 'A' in image.getbands() else 'RGB'
+    normalized = image if image.mode == mode else image.convert(mode)
+
+    digest = hashlib.sha256()
+    digest.update(f"{mode}:{normalized.size[0]}x{normalized.size[1]}:".encode('ascii'))
+    digest.update(normalized.tobytes())
+    return digest.hexdigest()
+
+
+def image_cache_key(image, prompt_hash):
+    """根据归一化后的像素内容和prompt哈希生成缓存键"""
+    return f"image:{image_digest(image)}:{prompt_hash}"
+
+
+def text_cache_key(text, prompt_hash):
+    """根据归一化后的文本内容和prompt哈希生成缓存键"""
+    normalized = text.replace('\r\n', '\n').strip()
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    return f"text:{digest}:{prompt_hash}"
+
+
+class AnalysisCache:
+    """基于SQLite的分析结果缓存，按最近访问时间（LRU）和条目年龄淘汰"""
+
+    def __init__(self, db_path, max_entries=5000, max_age_days=180):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                category TEXT NOT NULL,
+                tags TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON analysis(last_access)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """查询缓存，命中时返回分析结果字典，否则返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, category, tags, created FROM analysis WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            now = time.time()
+            if row is None or now - row[3] > self.max_age:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE analysis SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        return {
+            'summary': row[0],
+            'category': row[1],
+            'tags': row[2]
+        }
+
+    def put(self, key, analysis):
+        """写入分析结果"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis (key, summary, category, tags, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, analysis['summary'], analysis['category'], analysis['tags'], now, now)
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        """淘汰过期条目，并在超出容量时删除最久未访问的条目"""
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis WHERE created < ?", (time.time() - self.max_age,))
+            self._conn.execute("""
+                DELETE FROM analysis WHERE key IN (
+                    SELECT key FROM analysis ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,316 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+from gemini_handler import GeminiHandler, CombinedAnalysis
+from rate_limiter import estimate_tokens
+from text_chunker import split_markdown
+from job_queue import JobCancelled, raise_if_cancelled
+import metrics
+
+
+async def _gather(*coros):
+    """并发执行协程并按顺序返回结果，任一失败时取消其余的"""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+class AsyncGeminiHandler(GeminiHandler):
+    """基于 generate_content_async 的模型请求：所有请求在专用的事件循环线程中执行，
+    等待响应时不占用线程，调用方通过 concurrent.futures.Future 获取结果"""
+
+    def __init__(self):
+        super().__init__()
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._semaphore = None
+
+    @property
+    def loop(self):
+        """首次提交请求时启动事件循环线程"""
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+                    self._loop_thread = threading.Thread(
+                        target=self._run_loop, args=(loop, ready), name="GeminiAsync", daemon=True
+                    )
+                    self._loop_thread.start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    def _run_loop(self, loop, ready):
+        """事件循环线程：运行到 close() 为止，退出前等待被取消的请求结束"""
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+            pending = asyncio.all_tasks(loop)
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+    def submit(self, coro_func, *args):
+        """在事件循环线程中执行 coro_func(*args)，返回 concurrent.futures.Future"""
+        # 调用方的Trace和当前任务随上下文传入，请求耗时和取消状态与同步模式一致
+        context = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(self._run_in_context(context, coro_func, *args), self.loop)
+
+    @staticmethod
+    async def _run_in_context(context, coro_func, *args):
+        """在事件循环的Task中恢复调用方的上下文变量后执行"""
+        for var, value in context.items():
+            var.set(value)
+        return await coro_func(*args)
+
+    def submit_image(self, image):
+        """提交图片分析，返回Future；图片在调用方线程中编码"""
+        if not isinstance(image, dict):
+            image = self.prepare_image(image)
+        return self.submit(self.analyze_image_async, image)
+
+    def submit_text(self, md_text, on_summary_chunk=None):
+        """提交文本分析，返回Future；on_summary_chunk 在事件循环线程中调用"""
+        return self.submit(self.analyze_text_async, md_text, on_summary_chunk)
+
+    def analyze_image(self, image):
+        """与 GeminiHandler 相同的同步接口，阻塞直到分析完成"""
+        return self.submit_image(image).result()
+
+    def analyze_text(self, md_text, on_summary_chunk=None):
+        """与 GeminiHandler 相同的同步接口，阻塞直到分析完成"""
+        return self.submit_text(md_text, on_summary_chunk).result()
+
+    def close(self):
+        """取消尚未完成的请求并停止事件循环线程"""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            def stop():
+                for task in asyncio.all_tasks(loop):
+                    task.cancel()
+                loop.stop()
+            loop.call_soon_threadsafe(stop)
+            self._loop_thread.join(timeout=5)
+        super().close()
+
+    async def _get_model(self):
+        """取得模型客户端，需要创建或续期上下文缓存时在线程中执行，避免阻塞事件循环"""
+        if self._model is None or (self._cache is not None and time.time() >= self._cache_refresh_at):
+            return await asyncio.to_thread(lambda: self.model)
+        return self._model
+
+    async def generate_content_async(self, contents, stage='gemini', on_chunk=None, **kwargs):
+        """generate_content 的协程版本，同时进行的请求数不超过 max_in_flight"""
+        if on_chunk is None:
+            async def request():
+                raise_if_cancelled()
+                model = await self._get_model()
+                async with self._semaphore:
+                    return await model.generate_content_async(contents, **kwargs)
+        else:
+            request = self._stream_request_async(contents, stage, on_chunk, **kwargs)
+
+        with metrics.span(stage):
+            response = await self.rate_limiter.call_async(request, estimate_tokens(contents))
+        trace = metrics.current_trace()
+        if trace:
+            trace.add_tokens(getattr(response, 'usage_metadata', None))
+        return response
+
+    def _stream_request_async(self, contents, stage, on_chunk, **kwargs):
+        """生成一次流式请求的协程函数，返回读取完毕的响应"""
+        emitted = False
+
+        async def request():
+            nonlocal emitted
+            if emitted:
+                on_chunk(None)
+                emitted = False
+
+            raise_if_cancelled()
+            model = await self._get_model()
+            async with self._semaphore:
+                start = time.perf_counter()
+                response = await model.generate_content_async(contents, stream=True, **kwargs)
+                async for chunk in response:
+                    raise_if_cancelled()
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    if not text:
+                        continue
+                    if not emitted:
+                        trace = metrics.current_trace()
+                        if trace:
+                            trace.add(f"{stage}.first_chunk", (time.perf_counter() - start) * 1000)
+                        emitted = True
+                    on_chunk(text)
+            return response
+
+        return request
+
+    async def count_text_tokens_async(self, md_text):
+        """count_text_tokens 的协程版本"""
+        estimate = estimate_tokens(md_text)
+        if not self.long_text_threshold // 2 <= estimate <= self.long_text_threshold * 2:
+            return estimate
+        try:
+            with metrics.span('gemini.count_tokens'):
+                model = await self._get_model()
+                return (await model.count_tokens_async(md_text)).total_tokens
+        except Exception as e:
+            print(f"token计数失败，使用估算值: {str(e)}")
+            return estimate
+
+    async def analyze_image_async(self, image):
+        """analyze_image 的协程版本，image 为 prepare_image 返回的blob"""
+        if self.analysis_mode == 'combined':
+            result = await self.combined_analyze_async(self.prompts['combined']['image_prompt'], image)
+            if result:
+                return result
+
+        async def summary_and_tags():
+            summary = (await self.image_summary_analyze_async(image)).text
+            return summary, (await self.image_tag_analyze_async(summary)).text
+
+        (summary, tags), category = await _gather(
+            summary_and_tags(),
+            self.image_category_judge_async(image)
+        )
+        return {
+            'summary': summary,
+            'category': category.text,
+            'tags': tags
+        }
+
+    async def analyze_text_async(self, md_text, on_summary_chunk=None):
+        """analyze_text 的协程版本"""
+        if await self.count_text_tokens_async(md_text) > self.long_text_threshold:
+            return await self.analyze_long_text_async(md_text, on_summary_chunk)
+
+        if self.analysis_mode == 'combined':
+            result = await self.combined_analyze_async(self.prompts['combined']['markdown_prompt'], md_text)
+            if result:
+                return result
+
+        category, summary, tags = await _gather(
+            self.md_category_judge_async(md_text),
+            self.md_summary_analyze_async(md_text, on_summary_chunk),
+            self.md_tag_analyze_async(md_text)
+        )
+        return {
+            'summary': summary.text,
+            'category': category.text,
+            'tags': tags.text
+        }
+
+    async def analyze_long_text_async(self, md_text, on_summary_chunk=None):
+        """analyze_long_text 的协程版本"""
+        chunks = split_markdown(md_text, self.long_text_chunk_tokens)
+        summaries = await self._map_chunks_async(self.md_chunk_summary_analyze_async, chunks)
+
+        while len(summaries) > 1 and estimate_tokens(summaries) > self.long_text_chunk_tokens:
+            groups = split_markdown('\n\n'.join(summaries), self.long_text_chunk_tokens)
+            if len(groups) >= len(summaries):
+                break
+            summaries = await self._map_chunks_async(self.md_reduce_analyze_async, groups)
+
+        summary = (await self.md_reduce_analyze_async('\n\n'.join(summaries), on_summary_chunk)).text
+        category, tags = await _gather(
+            self.md_category_judge_async(summary),
+            self.md_tag_analyze_async(summary)
+        )
+        return {
+            'summary': summary,
+            'category': category.text,
+            'tags': tags.text
+        }
+
+    async def _map_chunks_async(self, analyze, chunks):
+        """并发分析各个分块，按原顺序返回结果文本"""
+        responses = await _gather(*(analyze(chunk) for chunk in chunks))
+        return [response.text for response in responses]
+
+    async def combined_analyze_async(self, prompt, content):
+        """combined_analyze 的协程版本，解析失败时返回None"""
+        try:
+            response = await self.generate_content_async(
+                [prompt, content],
+                stage='gemini.combined',
+                generation_config={
+                    'response_mime_type': "application/json",
+                    'response_schema': CombinedAnalysis
+                }
+            )
+            return self._parse_combined_result(response.text)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"合并分析失败，改用逐项分析: {str(e)}")
+            return None
+
+    async def image_summary_analyze_async(self, image, on_chunk=None):
+        """获取图片描述"""
+        return await self.generate_content_async([
+            self.prompts['image']['summary_prompt'],
+            image
+        ], stage='gemini.image_summary', on_chunk=on_chunk)
+
+    async def image_tag_analyze_async(self, image_summary):
+        """分析图片标签"""
+        return await self.generate_content_async([
+            self.prompts['image']['tag_prompt'],
+            image_summary
+        ], stage='gemini.image_tags')
+
+    async def image_category_judge_async(self, image):
+        """判断图片类别"""
+        return await self.generate_content_async([
+            self.prompts['image']['category_prompt'],
+            image
+        ], stage='gemini.image_category')
+
+    async def md_category_judge_async(self, md_text):
+        """判断文本类别"""
+        return await self.generate_content_async([
+            self.prompts['markdown']['category_prompt'],
+            md_text
+        ], stage='gemini.md_category')
+
+    async def md_summary_analyze_async(self, md_text, on_chunk=None):
+        """获取文本描述"""
+        return await self.generate_content_async([
+            self.prompts['markdown']['summary_prompt'],
+            md_text
+        ], stage='gemini.md_summary', on_chunk=on_chunk)
+
+    async def md_chunk_summary_analyze_async(self, chunk):
+        """获取长文本中一个分块的摘要"""
+        prompt = self.prompts['markdown'].get('chunk_summary_prompt', self.prompts['markdown']['summary_prompt'])
+        return await self.generate_content_async([prompt, chunk], stage='gemini.md_chunk_summary')
+
+    async def md_reduce_analyze_async(self, summaries, on_chunk=None):
+        """将多个分块摘要合并为完整的文本描述"""
+        prompt = self.prompts['markdown'].get('reduce_prompt', self.prompts['markdown']['summary_prompt'])
+        return await self.generate_content_async([prompt, summaries], stage='gemini.md_reduce', on_chunk=on_chunk)
+
+    async def md_tag_analyze_async(self, md_text):
+        """分析文本标签"""
+        return await self.generate_content_async([
+            self.prompts['markdown']['tag_prompt'],
+            md_text
+        ], stage='gemini.md_tags')
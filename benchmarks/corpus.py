@@ -0,0 +1,90 @@
+"""基准测试用的合成语料：截图和带元数据的markdown"""
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+# 截图尺寸：从普通窗口截图到8K整屏截图，PNG大小约200KB到30MB
+SCREENSHOT_SIZES = {
+    'small': (800, 600),
+    'medium': (1920, 1080),
+    'large': (3840, 2160),
+    'huge': (7680, 4320),
+}
+
+# markdown大小（字节）
+MARKDOWN_SIZES = {
+    '1k': 1024,
+    '64k': 64 * 1024,
+    '1m': 1024 * 1024,
+    '5m': 5 * 1024 * 1024,
+}
+
+
+def make_screenshot(size, seed=0):
+    """生成类似截图的图片：纯色界面区块、文字行和一块照片般的噪声区域"""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new('RGB', size, (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+
+    # 界面区块
+    for _ in range(20):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(50, width // 2)), min(height, y0 + rng.randrange(20, height // 4))
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    # 文字行（用细小的矩形模拟字形）
+    line_height = max(12, height // 60)
+    for y in range(0, height, line_height * 2):
+        x = rng.randrange(20)
+        while x < width * 0.6:
+            glyph = rng.randrange(4, line_height)
+            draw.rectangle((x, y, x + glyph, y + line_height - 2), fill=(30, 30, 30))
+            x += glyph + rng.randrange(2, 8)
+
+    # 照片区域：随机噪声，压缩率低
+    noise_size = (width // 2, height // 2)
+    noise = Image.frombytes('RGB', noise_size, rng.randbytes(noise_size[0] * noise_size[1] * 3))
+    image.paste(noise, (width // 2, height // 2))
+    return image
+
+
+def make_markdown(target_bytes, seed=0):
+    """生成带标题和元数据块的markdown文本"""
+    rng = random.Random(seed)
+    header = "\n".join([
+        "---",
+        "created: 2024-01-01",
+        "tags:",
+        "  - 基准测试",
+        "  - benchmark",
+        "source: https://example.com/article",
+        "author: TagSnap",
+        "---",
+        "# 基准测试文章",
+        "",
+    ])
+    words = ["性能", "测试", "markdown", "段落", "内容", "summary", "数据", "分析", "TagSnap", "笔记"]
+
+    parts = [header]
+    size = len(header.encode('utf-8'))
+    section = 0
+    while size < target_bytes:
+        if section % 10 == 0:
+            block = f"\n## 第{section // 10 + 1}节\n\n"
+        else:
+            block = " ".join(rng.choice(words) for _ in range(40)) + "\n\n"
+        parts.append(block)
+        size += len(block.encode('utf-8'))
+        section += 1
+    return "".join(parts)
+
+
+def png_size(image, directory):
+    """返回图片以PNG保存后的字节数"""
+    path = os.path.join(directory, "_size_probe.png")
+    image.save(path)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
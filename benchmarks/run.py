@@ -0,0 +1,248 @@
+"""TagSnap 处理流程的基准测试
+
+用法（在仓库根目录运行，需要与程序相同的 config.ini）：
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --compare results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+
+from benchmarks.corpus import (
+    MARKDOWN_SIZES, SCREENSHOT_SIZES, make_markdown, make_screenshot, png_size
+)
+
+
+def measure(func, repeat, warmup=1):
+    """执行 func 并返回每次的耗时（毫秒）"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def make_result(name, params, timings, **extra):
+    """整理单项基准测试结果，extra 为附加的统计项"""
+    return {
+        **extra,
+        'name': name,
+        'params': params,
+        'runs': len(timings),
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.mean(timings),
+        'max_ms': max(timings),
+    }
+
+
+def bench_image_processor(images, work_dir, repeat):
+    """ImageProcessor.save_image 和 create_md_file"""
+    from image_processor import ImageProcessor
+
+    processor = ImageProcessor(work_dir)
+    results = []
+    for size_name, image in images.items():
+        params = {'size': size_name, 'pixels': image.size, 'png_bytes': png_size(image, work_dir)}
+        timings = measure(lambda: processor.save_image(image), repeat)
+        results.append(make_result('image_processor.save_image', params, timings))
+
+    md_path = os.path.join(work_dir, "bench.md")
+    summary = "模拟描述" * 200
+    timings = measure(
+        lambda: processor.create_md_file(md_path, "images/bench.png", "文字材料", "标签 基准", summary),
+        repeat * 10
+    )
+    results.append(make_result('image_processor.create_md_file', {}, timings))
+    return results
+
+
+def measure_peak_memory(func):
+    """执行一次 func，返回期间新分配内存的峰值（字节）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_text_processor(texts, work_dir, repeat):
+    """TextProcessor.process_source，附带每MB耗时和峰值内存，用于确认耗时线性增长、内存不随输入增长"""
+    from text_processor import TextProcessor
+
+    processor = TextProcessor(work_dir)
+    results = []
+    for size_name, text in texts.items():
+        size = len(text.encode('utf-8'))
+        params = {'size': size_name, 'bytes': size}
+        run = lambda: processor.process_source(text, processor.source_dir)
+        timings = measure(run, repeat)
+        results.append(make_result(
+            'text_processor.process_source', params, timings,
+            ms_per_mb=statistics.median(timings) / (size / 1024 / 1024),
+            peak_kb=measure_peak_memory(run) / 1024
+        ))
+    return results
+
+
+def bench_show_image(images, repeat):
+    """MainUI.show_image 以及拖动窗口时的快速重绘"""
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"跳过界面基准测试（无法创建窗口: {e}）")
+        return []
+
+    from ui_components import MainUI
+
+    results = []
+    try:
+        root.geometry("800x600")
+        ui = MainUI(root, None)
+        root.update()
+        for size_name, image in images.items():
+            params = {'size': size_name, 'pixels': image.size}
+            timings = measure(lambda: ui.show_image(image), repeat)
+            results.append(make_result('ui.show_image', params, timings))
+
+            def fast_render():
+                ui.display_size = None
+                ui.render_image(sharp=False)
+
+            timings = measure(fast_render, repeat)
+            results.append(make_result('ui.render_image_fast', params, timings))
+    finally:
+        root.destroy()
+    return results
+
+
+def bench_end_to_end(images, texts, work_dir, repeat, latency):
+    """使用模拟模型的完整粘贴流程（不使用缓存和去重）"""
+    from capture_pipeline import CapturePipeline
+    from benchmarks.stubs import StubGeminiHandler
+
+    pipeline = CapturePipeline(
+        gemini=StubGeminiHandler(latency=latency),
+        image_note_path=os.path.join(work_dir, "image_notes"),
+        text_note_path=os.path.join(work_dir, "text_notes"),
+        sync_index=False
+    )
+    pipeline.image_cache = pipeline.text_cache = pipeline.image_index = None
+
+    results = []
+    for size_name, image in images.items():
+        params = {'size': size_name, 'latency_s': latency}
+        timings = measure(lambda: pipeline.process_image(image), repeat)
+        results.append(make_result('end_to_end.paste_image', params, timings))
+    for size_name, text in texts.items():
+        params = {'size': size_name, 'latency_s': latency}
+        timings = measure(lambda: pipeline.process_text(text), repeat)
+        results.append(make_result('end_to_end.paste_text', params, timings))
+    return results
+
+
+def result_key(result):
+    return f"{result['name']}[{result['params'].get('size', '')}]"
+
+
+def compare(results, baseline_path, threshold):
+    """与之前的结果对比中位数，返回退化的项目数"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"\n与 {baseline_path} 对比（阈值 {threshold:.0%}）：")
+    for result in results:
+        key = result_key(result)
+        old = baseline.get(key)
+        if not old:
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- 退化"
+            regressions += 1
+        print(f"  {key:50s} {old['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TagSnap 处理流程基准测试")
+    parser.add_argument('--quick', action='store_true', help="只测试较小的语料")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数")
+    parser.add_argument('--latency', type=float, default=0.2, help="模拟模型每次请求的延迟（秒）")
+    parser.add_argument('--only', default=None, help="只运行名称包含该字符串的基准测试组")
+    parser.add_argument('--output', default=None, help="结果JSON的保存路径")
+    parser.add_argument('--compare', default=None, help="用于对比的历史结果JSON")
+    parser.add_argument('--threshold', type=float, default=0.1, help="判定为退化的中位数增幅")
+    args = parser.parse_args(argv)
+
+    image_sizes = ['small', 'medium'] if args.quick else list(SCREENSHOT_SIZES)
+    text_sizes = ['1k', '64k'] if args.quick else list(MARKDOWN_SIZES)
+    repeat = 2 if args.quick else args.repeat
+
+    print("正在生成语料...")
+    images = {name: make_screenshot(SCREENSHOT_SIZES[name], seed=i) for i, name in enumerate(image_sizes)}
+    texts = {name: make_markdown(MARKDOWN_SIZES[name], seed=i) for i, name in enumerate(text_sizes)}
+
+    groups = {
+        'image_processor': lambda work_dir: bench_image_processor(images, work_dir, repeat),
+        'text_processor': lambda work_dir: bench_text_processor(texts, work_dir, repeat),
+        'ui': lambda work_dir: bench_show_image(images, repeat),
+        'end_to_end': lambda work_dir: bench_end_to_end(images, texts, work_dir, repeat, args.latency),
+    }
+
+    results = []
+    for group, run in groups.items():
+        if args.only and args.only not in group:
+            continue
+        print(f"运行 {group} ...")
+        with tempfile.TemporaryDirectory(prefix="tagsnap_bench_") as work_dir:
+            for result in run(work_dir):
+                line = f"  {result_key(result):50s} median {result['median_ms']:10.2f} ms"
+                if 'peak_kb' in result:
+                    line += f"  {result['ms_per_mb']:8.2f} ms/MB  峰值内存 {result['peak_kb']:8.1f} KB"
+                print(line)
+                results.append(result)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pillow': PIL.__version__,
+            'quick': args.quick,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""长时间运行的内存基准测试：模拟连续粘贴，检查常驻内存是否保持平稳
+
+用法（在仓库根目录运行，需要与程序相同的 config.ini）：
+    python benchmarks/soak.py --pastes 1000 --output soak.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import make_screenshot
+from benchmarks.stubs import StubGeminiHandler
+from memory_report import rss_bytes
+
+
+def simulate_paste(pipeline, image, display_edge):
+    """模拟一次图片粘贴：界面生成显示用的缩小副本，后台保存并分析后释放原图"""
+    factor = max(1, int(max(image.size) / display_edge))
+    display_copy = image.reduce(factor) if factor > 1 else image.copy()
+    with image:
+        pipeline.process_image(image)
+    return display_copy
+
+
+def sample(pastes, started):
+    """记录当前内存占用"""
+    gc.collect()
+    rss = rss_bytes()
+    point = {
+        'pastes': pastes,
+        'elapsed_s': round(time.perf_counter() - started, 2),
+        'rss_mb': round(rss / 1024 / 1024, 2) if rss is not None else None,
+    }
+    if tracemalloc.is_tracing():
+        point['traced_mb'] = round(tracemalloc.get_traced_memory()[0] / 1024 / 1024, 2)
+    return point
+
+
+def run(work_dir, pastes, size, sample_every, latency, display_edge):
+    from capture_pipeline import CapturePipeline
+
+    pipeline = CapturePipeline(
+        gemini=StubGeminiHandler(latency=latency),
+        image_note_path=os.path.join(work_dir, "image_notes"),
+        text_note_path=os.path.join(work_dir, "text_notes"),
+        sync_index=False
+    )
+
+    started = time.perf_counter()
+    samples = [sample(0, started)]
+    display_copy = None
+    try:
+        for i in range(1, pastes + 1):
+            # 界面只保留最近一张图片的显示副本
+            display_copy = simulate_paste(pipeline, make_screenshot(size, seed=i), display_edge)
+            if i % sample_every == 0 or i == pastes:
+                samples.append(sample(i, started))
+                point = samples[-1]
+                print(f"  {point['pastes']:6d} 次粘贴  常驻内存 {point['rss_mb']} MB"
+                      + (f"  Python分配 {point['traced_mb']} MB" if 'traced_mb' in point else ""))
+    finally:
+        pipeline.image_processor.close()
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TagSnap 连续粘贴内存基准测试")
+    parser.add_argument('--pastes', type=int, default=1000, help="模拟粘贴次数")
+    parser.add_argument('--size', default="1280x800", help="模拟截图尺寸")
+    parser.add_argument('--sample-every', type=int, default=50, help="每隔多少次粘贴记录一次内存")
+    parser.add_argument('--latency', type=float, default=0.0, help="模拟模型每次请求的延迟（秒）")
+    parser.add_argument('--display-edge', type=int, default=1200, help="界面显示副本的最大边长")
+    parser.add_argument('--tracemalloc', action='store_true', help="同时记录Python分配的内存（较慢）")
+    parser.add_argument('--max-growth-mb', type=float, default=50.0, help="预热后常驻内存允许的最大增长")
+    parser.add_argument('--output', default=None, help="结果JSON的保存路径")
+    args = parser.parse_args(argv)
+
+    size = tuple(int(value) for value in args.size.lower().split('x'))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    print(f"模拟 {args.pastes} 次 {args.size} 截图粘贴...")
+    with tempfile.TemporaryDirectory(prefix="tagsnap_soak_") as work_dir:
+        samples = run(work_dir, args.pastes, size, args.sample_every, args.latency, args.display_edge)
+
+    # 以第一次采样（预热后）为基准计算增长，排除缓存、线程池等一次性的初始化开销
+    baseline = samples[1] if len(samples) > 2 else samples[0]
+    growth = None
+    if baseline['rss_mb'] is not None:
+        growth = samples[-1]['rss_mb'] - baseline['rss_mb']
+        print(f"预热后常驻内存增长 {growth:.1f} MB（上限 {args.max_growth_mb:.1f} MB）")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'params': {'pastes': args.pastes, 'size': args.size, 'latency_s': args.latency},
+                'rss_growth_mb': growth,
+                'samples': samples,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    return 1 if growth is not None and growth > args.max_growth_mb else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
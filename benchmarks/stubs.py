@@ -0,0 +1,40 @@
+"""端到端基准测试使用的模拟GeminiHandler，用固定延迟代替网络请求"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from image_encoder import encode_for_upload
+from task_graph import TaskGraph
+
+
+class StubGeminiHandler:
+    def __init__(self, latency=0.5, max_concurrency=4):
+        self.latency = latency
+        self.upload_max_edge = 2048
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def _respond(self, text):
+        time.sleep(self.latency)
+        return text
+
+    def prompt_fingerprint(self, kind):
+        return f"stub-{kind}"
+
+    def prepare_image(self, image):
+        return encode_for_upload(image)
+
+    def analyze_image(self, image):
+        graph = TaskGraph(self.executor)
+        graph.add('summary', lambda: self._respond("模拟图片描述"))
+        graph.add('category', lambda: self._respond("文字材料"))
+        graph.add('tags', lambda summary: self._respond("模拟 标签"), 'summary')
+        return graph.run()
+
+    def analyze_text(self, md_text, on_summary_chunk=None):
+        graph = TaskGraph(self.executor)
+        graph.add('category', lambda: self._respond("理论知识"))
+        graph.add('summary', lambda: self._respond("模拟文本摘要"))
+        graph.add('tags', lambda: self._respond("模拟 标签"))
+        return graph.run()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,274 @@
+"""批量导入：不启动界面，直接用截图/markdown目录生成笔记
+
+用法：python bulk_import.py <目录> [--workers 4] [--checkpoint 文件] [--async-requests]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import config
+
+TEXT_EXTENSIONS = ['.md', '.markdown', '.txt']
+
+
+class Checkpoint:
+    """记录已处理文件的断点文件，每处理完一个文件追加一行"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, source_path):
+        return source_path in self.done
+
+    def mark_done(self, source_path):
+        """记录文件已处理"""
+        with self._lock:
+            self.done.add(source_path)
+            self._file.write(source_path + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def collect_files(root_dir):
+    """遍历目录，返回待导入的 (类型, 路径) 列表"""
+    # 不导入笔记目录自身生成的笔记、图片、原文和内部数据，导入目录是笔记库或其上级目录时同样跳过
+    excluded = {
+        os.path.abspath(config.IMAGE_NOTE_PATH),
+        os.path.abspath(config.TEXT_NOTE_PATH),
+        os.path.abspath(config.get_image_save_path()),
+        os.path.abspath(os.path.join(config.TEXT_NOTE_PATH, config.SOURCE_SUBDIR)),
+        os.path.abspath(os.path.join(config.IMAGE_NOTE_PATH, config.DATA_SUBDIR)),
+        os.path.abspath(os.path.join(config.TEXT_NOTE_PATH, config.DATA_SUBDIR)),
+    }
+
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        if os.path.abspath(dirpath) in excluded:
+            dirnames[:] = []
+            continue
+        # 跳过隐藏目录（如 .tagsnap、.obsidian）
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if not d.startswith('.') and os.path.abspath(os.path.join(dirpath, d)) not in excluded
+        )
+        for filename in sorted(filenames):
+            ext = os.path.splitext(filename)[1].lower()
+            path = os.path.abspath(os.path.join(dirpath, filename))
+            if ext in config.VALID_IMAGE_EXTENSIONS:
+                files.append(('image', path))
+            elif ext in TEXT_EXTENSIONS:
+                files.append(('text', path))
+    return files
+
+
+def image_status(result):
+    """图片处理结果对应的 (状态, 说明)"""
+    if result.get('duplicate'):
+        return 'skipped', f"已有相似图片笔记 {result['filename']}"
+    return 'imported', result['filename']
+
+
+def read_text(pipeline, path):
+    """读取文本文件，已存在同名笔记时返回 (None, 跳过说明)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    title, _, _ = pipeline.text_processor.find_title(text)
+    if title and os.path.exists(pipeline.get_text_note_path(title)):
+        return None, f"已有笔记 {title}.md"
+    return text, None
+
+
+def import_file(pipeline, kind, path):
+    """导入单个文件，返回 (状态, 说明)"""
+    if kind == 'image':
+        from PIL import Image
+
+        # 不预先解码，可接受格式的文件会被直接复制，分析时按需缩小解码
+        with Image.open(path) as image:
+            return image_status(pipeline.process_image(image))
+
+    text, skipped = read_text(pipeline, path)
+    if text is None:
+        return 'skipped', skipped
+    return 'imported', pipeline.process_text(text)['filename']
+
+
+def start_import(pipeline, kind, path, in_flight):
+    """异步请求模式下导入单个文件：保存和编码在当前线程完成，分析交给事件循环；
+    返回完成后得到 (状态, 说明) 的Future，in_flight 限制同时进行分析的文件数"""
+    if kind == 'image':
+        from PIL import Image
+
+        in_flight.acquire()
+        try:
+            with Image.open(path) as image:
+                future = pipeline.submit_image(image)
+        except BaseException:
+            in_flight.release()
+            raise
+        future.add_done_callback(lambda _: in_flight.release())
+        return chain(future, image_status)
+
+    text, skipped = read_text(pipeline, path)
+    if text is None:
+        future = Future()
+        future.set_result(('skipped', skipped))
+        return future
+
+    in_flight.acquire()
+    try:
+        future = pipeline.submit_text(text)
+    except BaseException:
+        in_flight.release()
+        raise
+    future.add_done_callback(lambda _: in_flight.release())
+    return chain(future, lambda result: ('imported', result['filename']))
+
+
+def chain(future, convert, result=None):
+    """future 完成后以 convert(结果) 完成 result（未给出时新建），返回 result"""
+    result = result or Future()
+
+    def done(source):
+        try:
+            value = convert(source.result())
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(value)
+
+    future.add_done_callback(done)
+    return result
+
+
+def submit_import(executor, pipeline, kind, path, in_flight):
+    """在线程池中开始导入一个文件，返回该文件导入完成时完成的Future"""
+    result = Future()
+
+    def start():
+        try:
+            future = start_import(pipeline, kind, path, in_flight)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            chain(future, lambda value: value, result)
+
+    executor.submit(start)
+    return result
+
+
+def run(root_dir, workers, checkpoint_path, async_requests=False):
+    """执行批量导入，返回失败的文件数"""
+    from capture_pipeline import CapturePipeline
+
+    config.setup_proxy()
+    config.ensure_directories()
+
+    checkpoint = Checkpoint(checkpoint_path)
+    files = [(kind, path) for kind, path in collect_files(root_dir) if path not in checkpoint]
+    total = len(files)
+    print(f"待导入 {total} 个文件（断点文件中已完成 {len(checkpoint.done)} 个）")
+    if not total:
+        checkpoint.close()
+        return 0
+
+    # 异步模式下线程池只负责解码、保存和编码，分析在事件循环中等待，
+    # 同时进行分析的文件数由 in_flight 限制，而不是线程数
+    gemini = None
+    in_flight = None
+    if async_requests:
+        from async_gemini import AsyncGeminiHandler
+        gemini = AsyncGeminiHandler()
+        in_flight = threading.BoundedSemaphore(gemini.max_in_flight)
+
+    # 导入前先同步已有图片的索引，保证相似图片能被跳过
+    pipeline = CapturePipeline(gemini=gemini, sync_index=False)
+    if pipeline.image_index:
+        print("正在同步图片索引...")
+        pipeline.image_index.sync()
+
+    counts = {'imported': 0, 'skipped': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if in_flight:
+            futures = {
+                submit_import(executor, pipeline, kind, path, in_flight): path
+                for kind, path in files
+            }
+        else:
+            futures = {
+                executor.submit(import_file, pipeline, kind, path): path
+                for kind, path in files
+            }
+        for finished, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                status, detail = future.result()
+                checkpoint.mark_done(path)
+            except Exception as e:
+                status, detail = 'failed', str(e)
+            counts[status] += 1
+
+            # 输出进度和预计剩余时间
+            elapsed = time.perf_counter() - start
+            remaining = elapsed / finished * (total - finished)
+            print(f"[{finished}/{total}] {status} {path} -> {detail}"
+                  f"（已用 {elapsed:.0f}s，剩余约 {remaining:.0f}s）")
+    except KeyboardInterrupt:
+        # 取消尚未开始的文件，正在处理的文件完成后退出
+        executor.shutdown(wait=True, cancel_futures=True)
+        print("已中断，再次运行将从断点继续")
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        checkpoint.close()
+        pipeline.close()
+
+    print(f"完成：导入 {counts['imported']}，跳过 {counts['skipped']}，失败 {counts['failed']}")
+    limiter_stats = pipeline.gemini.rate_limiter.stats()
+    print(f"模型请求 {limiter_stats['requests']} 次，重试 {limiter_stats['retries']} 次，"
+          f"限流等待 {limiter_stats['wait_seconds']:.1f}s")
+    return counts['failed']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入图片和markdown文件生成笔记")
+    parser.add_argument('directory', help="要导入的目录")
+    parser.add_argument('--workers', type=int, default=config.PIPELINE_WORKERS,
+                        help="处理文件的线程数；异步模式下只负责保存和编码，"
+                             "同时分析的文件数由 [gemini] max_in_flight 决定")
+    parser.add_argument('--checkpoint', default=None,
+                        help="断点文件路径，默认保存在笔记目录的 .tagsnap 中")
+    parser.add_argument('--async-requests', action='store_true', default=config.GEMINI_ASYNC,
+                        help="模型请求在单独的事件循环线程中异步执行")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"目录不存在: {args.directory}")
+
+    checkpoint_path = args.checkpoint or config.get_data_path(
+        config.IMAGE_NOTE_PATH, "bulk_import_checkpoint.txt"
+    )
+    failed = run(args.directory, max(1, args.workers), checkpoint_path, args.async_requests)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
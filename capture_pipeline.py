@@ -0,0 +1,705 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, as_completed
+
+from gemini_handler import GeminiHandler
+from async_gemini import AsyncGeminiHandler
+from image_processor import ImageProcessor, open_reduced
+from text_processor import TextProcessor
+from analysis_cache import AnalysisCache, image_cache_key, image_digest, text_cache_key
+from image_index import ImageIndex, dhash
+from metrics import MetricsRecorder, Trace, current_trace
+from speculation import SpeculativeResults
+from job_journal import JobJournal, network_available
+from job_queue import JobCancelled
+import config
+
+
+def _ignore_progress(message):
+    pass
+
+
+def _completed(value):
+    """返回已完成的Future"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class CapturePipeline:
+    """保存 → 分析 → 写入笔记的处理流程，不依赖Tk，可供界面和命令行共用"""
+
+    def __init__(self, gemini=None, image_note_path=None, text_note_path=None, sync_index=True):
+        image_note_path = image_note_path or config.IMAGE_NOTE_PATH
+        text_note_path = text_note_path or config.TEXT_NOTE_PATH
+
+        # 初始化AI模型
+        if gemini is None:
+            gemini = AsyncGeminiHandler() if config.GEMINI_ASYNC else GeminiHandler()
+        self.gemini = gemini
+
+        # 初始化分析结果缓存
+        self.image_cache = self.create_cache(image_note_path)
+        self.text_cache = self.create_cache(text_note_path)
+
+        # 初始化图片处理器
+        self.image_processor = ImageProcessor(image_note_path)
+
+        # 初始化相似图片索引
+        self.image_index = None
+        if config.DEDUP_ENABLED:
+            self.image_index = ImageIndex(
+                self.image_processor.images_dir,
+                config.get_data_path(image_note_path, "image_index.db"),
+                max_distance=config.DEDUP_MAX_DISTANCE,
+                file_digest=self.file_digest
+            )
+            if sync_index:
+                self.image_index.start_sync()
+
+        # 剪贴板预分析的结果
+        self.speculation = None
+        if config.CLIPBOARD_WATCH_ENABLED:
+            self.speculation = SpeculativeResults(ttl=config.SPECULATION_TTL)
+
+        # 初始化文本处理器
+        self.text_processor = TextProcessor(text_note_path)
+
+        # 初始化捕获日志，网络请求失败的捕获在重启或联网后重放
+        self.journal = None
+        self._replay_stop = threading.Event()
+        self._replay_thread = None
+        if config.JOURNAL_ENABLED:
+            self.journal = JobJournal(
+                config.get_data_path(image_note_path, "journal.db"),
+                max_attempts=config.JOURNAL_MAX_ATTEMPTS
+            )
+
+        # 异步模式下写入笔记的线程池，首次提交时创建
+        self._note_writer = None
+        self._note_writer_lock = threading.Lock()
+        self._closed = False
+
+        # 初始化性能记录
+        self.metrics = None
+        if config.METRICS_ENABLED:
+            self.metrics = MetricsRecorder(
+                config.get_data_path(image_note_path, "metrics.jsonl"),
+                max_bytes=config.METRICS_LOG_MAX_BYTES,
+                backup_count=config.METRICS_LOG_BACKUPS,
+                prometheus_path=config.METRICS_PROMETHEUS_PATH or None
+            )
+
+    def run_traced(self, trace, func, *args):
+        """在Trace上下文中执行处理流程，结束后记录性能数据"""
+        try:
+            with trace.activate():
+                return func(*args)
+        except Exception as e:
+            trace.error = str(e)
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.record(trace)
+
+    def create_cache(self, note_dir):
+        """创建笔记目录下的分析结果缓存"""
+        if not config.CACHE_ENABLED:
+            return None
+        return AnalysisCache(
+            config.get_data_path(note_dir, "analysis_cache.db"),
+            max_entries=config.CACHE_MAX_ENTRIES,
+            max_age_days=config.CACHE_MAX_AGE_DAYS
+        )
+
+    def analyze_with_cache(self, cache, key, analyze, report=_ignore_progress):
+        """优先从缓存获取分析结果，未命中时调用模型并写入缓存"""
+        if cache is None:
+            return analyze()
+
+        analysis = cache.get(key)
+        if analysis:
+            report("已命中分析缓存")
+            return analysis
+
+        analysis = analyze()
+        cache.put(key, analysis)
+        return analysis
+
+    def process_image(self, image, report=_ignore_progress, trace=None):
+        """处理图片"""
+        return self.run_traced(trace or Trace('image'), self._process_image, image, report)
+
+    def _process_image(self, image, report):
+        trace = current_trace()
+
+        # 来自文件的图片只按分析所需的尺寸解码，原文件直接复制保存
+        with trace.span('image.decode'):
+            max_edge = self.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+
+        try:
+            return self._save_and_analyze(image, analysis_image, report)
+        finally:
+            # 单独解码的分析用图片用完即释放
+            if analysis_image is not image:
+                analysis_image.close()
+
+    def _save_and_analyze(self, image, analysis_image, report):
+        trace = current_trace()
+
+        # 查找内容相同的图片，命中时直接复用已有笔记
+        image_hash = digest = None
+        if self.image_index:
+            with trace.span('image.dedup'):
+                image_hash, digest = dhash(analysis_image), image_digest(analysis_image)
+                duplicate = self.find_duplicate_note(image_hash, digest)
+            if duplicate:
+                return duplicate
+
+        # 保存图片
+        report("正在保存图片...")
+        with trace.span('image.save'):
+            save_info = self.image_processor.save_image(image)
+        trace.add('image.encode', save_info['encode_ms'])
+
+        if self.image_index:
+            self.image_index.add(os.path.basename(save_info['image_path']), image_hash, digest)
+
+        # 图片已保存，先记录日志再发起网络请求
+        try:
+            return self.run_journaled('image', save_info, self._analyze_and_write_image, analysis_image, save_info, report)
+        except JobCancelled:
+            # 取消的捕获不会写入笔记，删除已保存的图片，避免留下没有笔记的图片
+            self.discard_saved_image(save_info)
+            raise
+
+    def discard_saved_image(self, save_info):
+        """删除已保存但不再写入笔记的图片，并将其移出相似图片索引"""
+        image_filename = os.path.basename(save_info['image_path'])
+        if self.image_index:
+            self.image_index.remove(image_filename)
+        try:
+            os.remove(save_info['image_path'])
+        except FileNotFoundError:
+            pass
+
+    def _analyze_and_write_image(self, analysis_image, save_info, report):
+        trace = current_trace()
+
+        # 使用AI分析图片
+        report("正在分析图片...")
+        prompt_hash = self.gemini.prompt_fingerprint('image')
+        cache_key = image_cache_key(analysis_image, prompt_hash)
+        upload_bytes = 0
+
+        def analyze():
+            nonlocal upload_bytes
+            # 剪贴板预分析已经开始时直接使用其结果
+            speculative = self.take_speculative(cache_key, report)
+            if speculative:
+                upload_bytes = speculative['upload_bytes']
+                return speculative['analysis']
+
+            # 图片只编码一次，所有请求共用
+            with trace.span('image.encode_upload'):
+                upload = self.gemini.prepare_image(analysis_image)
+            upload_bytes = len(upload['data'])
+            report(f"正在分析图片（上传 {upload_bytes / 1024:.0f} KB）...")
+            return self.gemini.analyze_image(upload)
+
+        with trace.span('image.analyze'):
+            analysis = self.analyze_with_cache(
+                self.image_cache,
+                cache_key,
+                analyze,
+                report
+            )
+
+        return self._write_image_note(save_info, analysis, prompt_hash, upload_bytes)
+
+    def _write_image_note(self, save_info, analysis, prompt_hash, upload_bytes):
+        """创建图片的markdown笔记，返回处理结果"""
+        with current_trace().span('image.write_md'):
+            self.image_processor.create_md_file(
+                save_info['md_path'],
+                save_info['relative_path'],
+                analysis['category'],
+                analysis['tags'],
+                analysis['summary'],
+                prompt_hash
+            )
+
+        return {
+            'filename': save_info['filename'],
+            'analysis': analysis,
+            'format': save_info['format'],
+            'bytes': save_info['bytes'],
+            'encode_ms': save_info['encode_ms'],
+            'upload_bytes': upload_bytes
+        }
+
+    def run_journaled(self, kind, payload, func, *args):
+        """在日志中记录捕获后执行分析和写入笔记，成功后标记完成，失败时留待重放"""
+        if self.journal is None:
+            return func(*args)
+        return self._run_journal_entry(self.journal.record(kind, payload), func, *args)
+
+    def _run_journal_entry(self, journal_id, func, *args):
+        try:
+            result = func(*args)
+        except JobCancelled:
+            self.journal.cancel(journal_id)
+            raise
+        except Exception as e:
+            self.journal.fail(journal_id, str(e))
+            raise
+        self.journal.complete(journal_id)
+        return result
+
+    def replay_journal(self, report=_ignore_progress):
+        """重放日志中未完成的捕获，遇到失败时停止（多半是网络仍不可用），返回 (成功数, 失败数)"""
+        succeeded = failed = 0
+        for entry in self.journal.claim_pending():
+            if failed or self._replay_stop.is_set():
+                # 剩余的记录留到下次重放
+                self.journal.release(entry.id)
+                continue
+            try:
+                self.run_traced(Trace(f"replay.{entry.kind}"), self._run_journal_entry,
+                                entry.id, self._replay_entry, entry, report)
+                succeeded += 1
+            except Exception as e:
+                print(f"重放捕获 {entry.id} 失败: {str(e)}")
+                failed += 1
+        return succeeded, failed
+
+    def _replay_entry(self, entry, report):
+        """重新分析一条日志记录并写入笔记"""
+        payload = entry.payload
+        if entry.kind == 'text':
+            return self._analyze_and_write_text(payload['text'], payload['title'], report)
+
+        from PIL import Image
+
+        # 图片已被删除时没有需要补写的笔记
+        if not os.path.exists(payload['image_path']):
+            return None
+        with Image.open(payload['image_path']) as image:
+            max_edge = self.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+            try:
+                return self._analyze_and_write_image(analysis_image, payload, report)
+            finally:
+                if analysis_image is not image:
+                    analysis_image.close()
+
+    def start_journal_replay(self, interval, probe_address=None):
+        """启动后台线程：立即重放一次未完成的捕获，之后定期检查，网络恢复后继续重放"""
+        if self.journal is None:
+            return
+
+        def loop():
+            while not self._replay_stop.is_set():
+                try:
+                    if self.journal.has_pending() and (probe_address is None or network_available(probe_address)):
+                        succeeded, failed = self.replay_journal()
+                        print(f"重放未完成的捕获：成功 {succeeded}，失败 {failed}")
+                    self.journal.flush()
+                except Exception as e:
+                    print(f"重放捕获失败: {str(e)}")
+                self._replay_stop.wait(interval)
+
+        self._replay_thread = threading.Thread(target=loop, name="JournalReplay", daemon=True)
+        self._replay_thread.start()
+
+    def close(self, timeout=10):
+        """停止后台重放并释放资源；调用前应先停止仍在使用流程的工作线程"""
+        # 等待正在重放的记录结束后再关闭日志，否则已完成的记录会留在日志中被再次分析
+        self._replay_stop.set()
+        if self._replay_thread:
+            self._replay_thread.join(timeout)
+        if self.speculation:
+            self.speculation.close()
+        # 异步模式下仍在进行的分析被取消，等其记录放回后再关闭日志
+        self.gemini.close()
+        with self._note_writer_lock:
+            self._closed = True
+            note_writer, self._note_writer = self._note_writer, None
+        if note_writer:
+            note_writer.shutdown(wait=True)
+        if self.journal:
+            self.journal.close()
+        self.image_processor.close()
+
+    def speculate_image(self, image):
+        """剪贴板出现新图片时在后台提前编码并分析，结果保存到粘贴时取用"""
+        if self.speculation:
+            self.speculation.submit(self._speculate_image, image)
+
+    def _speculate_image(self, image):
+        # 预分析用的图片由剪贴板单独读取，分析完即释放
+        with image:
+            max_edge = self.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+            try:
+                self._speculate_analysis(analysis_image)
+            finally:
+                if analysis_image is not image:
+                    analysis_image.close()
+
+    def _speculate_analysis(self, analysis_image):
+        # 已有内容相同的图片或已缓存的内容不需要预分析
+        if self.image_index and self.image_index.find(dhash(analysis_image), image_digest(analysis_image)):
+            return
+        cache_key = image_cache_key(analysis_image, self.gemini.prompt_fingerprint('image'))
+        if self.image_cache and self.image_cache.get(cache_key):
+            return
+
+        future = self.speculation.start(cache_key)
+        if future is None:
+            return
+        try:
+            upload = self.gemini.prepare_image(analysis_image)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        # 等待模型响应时不占用预分析线程，之后复制的图片可以立即登记
+        self.speculation.run(future, self._speculative_request, upload)
+
+    def _speculative_request(self, upload):
+        analysis = self.gemini.analyze_image(upload)
+        return {'analysis': analysis, 'upload_bytes': len(upload['data'])}
+
+    def take_speculative(self, cache_key, report=_ignore_progress):
+        """取出预分析结果，仍在进行时等待完成；没有或失败时返回None"""
+        future = self.speculation.take(cache_key) if self.speculation else None
+        if future is None:
+            return None
+        if not future.done():
+            report("正在等待预分析结果...")
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"预分析失败，重新分析: {str(e)}")
+            return None
+        report("已使用预分析结果")
+        return result
+
+    def process_images(self, images, report=_ignore_progress, write_index=None):
+        """并行处理一批图片，返回汇总结果"""
+        if write_index is None:
+            write_index = config.BATCH_INDEX_NOTE
+
+        total = len(images)
+        results = [None] * total
+        failed = []
+        report(f"批量处理中：0/{total}")
+
+        # 各图片的保存和编码并行执行，模型请求仍受GeminiHandler的并发数和限流约束
+        with ThreadPoolExecutor(max_workers=config.BATCH_WORKERS, thread_name_prefix="Batch") as executor:
+            # 复制调用方的上下文，使批量处理线程能取到当前任务的取消状态
+            futures = {
+                executor.submit(contextvars.copy_context().run, self.process_image, image): i
+                for i, image in enumerate(images)
+            }
+            for finished, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except JobCancelled:
+                    # 任务已取消，尚未开始的图片不再处理
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                except Exception as e:
+                    failed.append((getattr(images[index], 'filename', '') or f"#{index + 1}", str(e)))
+                report(f"批量处理中：{finished}/{total}，失败 {len(failed)}")
+
+        results = [result for result in results if result]
+
+        # 生成链接所有笔记的索引
+        index_filename = None
+        if write_index and len(results) > 1:
+            index_filename = f"batch_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+            self.image_processor.create_index_file(
+                os.path.join(self.image_processor.note_dir, f"{index_filename}.md"),
+                [(result['filename'], result['analysis']['category']) for result in results]
+            )
+
+        return {
+            'results': results,
+            'failed': failed,
+            'index_filename': index_filename
+        }
+
+    def find_duplicate_note(self, image_hash, digest):
+        """根据感知哈希和内容摘要查找已有图片的笔记"""
+        image_filename = self.image_index.find(image_hash, digest)
+        if not image_filename:
+            return None
+
+        filename = os.path.splitext(image_filename)[0]
+        md_path = os.path.join(self.image_processor.note_dir, f"{filename}.md")
+        analysis = self.image_processor.read_md_file(md_path)
+        if not analysis:
+            return None
+
+        return {
+            'filename': filename,
+            'analysis': analysis,
+            'duplicate': True
+        }
+
+    def file_digest(self, path):
+        """按分析时的解码方式读取已保存的图片，计算内容摘要"""
+        from PIL import Image
+
+        with Image.open(path) as image:
+            max_edge = self.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+            try:
+                return image_digest(analysis_image)
+            finally:
+                if analysis_image is not image:
+                    analysis_image.close()
+
+    def get_text_note_path(self, title):
+        """获取文本笔记的路径"""
+        return os.path.join(self.text_processor.note_dir, f"{title}.md")
+
+    def process_text(self, text, report=_ignore_progress, trace=None, on_summary_chunk=None):
+        """处理文本，on_summary_chunk 用于流式接收摘要"""
+        return self.run_traced(trace or Trace('text'), self._process_text, text, report, on_summary_chunk)
+
+    def _process_text(self, text, report, on_summary_chunk):
+        trace = current_trace()
+
+        # 处理原始文本
+        report("正在处理文本...")
+        with trace.span('text.source'):
+            title = self.text_processor.process_source(text, self.text_processor.source_dir)
+
+        # 原文已保存，先记录日志再发起网络请求
+        try:
+            return self.run_journaled(
+                'text', {'text': text, 'title': title},
+                self._analyze_and_write_text, text, title, report, on_summary_chunk
+            )
+        except JobCancelled:
+            # 取消的捕获不会写入笔记，删除已保存的原文
+            self.discard_source(title)
+            raise
+
+    def discard_source(self, title):
+        """删除已保存但不再写入笔记的原文；同名笔记已存在时原文属于该笔记，保留"""
+        if os.path.exists(self.get_text_note_path(title)):
+            return
+        for directory in (self.text_processor.source_dir, self.text_processor.original_dir):
+            try:
+                os.remove(self.text_processor.get_source_path(title, directory))
+            except FileNotFoundError:
+                pass
+
+    def _analyze_and_write_text(self, text, title, report, on_summary_chunk=None):
+        trace = current_trace()
+
+        # 使用AI分析文本
+        report("正在分析文本...")
+        prompt_hash = self.gemini.prompt_fingerprint('markdown')
+        with trace.span('text.analyze'):
+            analysis = self.analyze_with_cache(
+                self.text_cache,
+                text_cache_key(text, prompt_hash),
+                lambda: self.gemini.analyze_text(text, on_summary_chunk),
+                report
+            )
+
+        return self._write_text_note(title, analysis, prompt_hash)
+
+    def _write_text_note(self, title, analysis, prompt_hash):
+        """创建文本的markdown笔记，返回处理结果"""
+        # 生成新的markdown文件路径
+        md_path = self.get_text_note_path(title)
+
+        # 创建处理后的markdown文件
+        with current_trace().span('text.write_md'):
+            self.text_processor.create_md_file(
+                md_path,
+                title,
+                analysis['category'],
+                analysis['tags'],
+                analysis['summary'],
+                prompt_hash
+            )
+
+        return {
+            'filename': os.path.basename(md_path),
+            'title': title,
+            'analysis': analysis
+        }
+
+    def submit_image(self, image, report=_ignore_progress, trace=None):
+        """异步请求模式下处理图片：解码、去重、保存和编码在当前线程中完成，分析交给事件循环，
+        完成后在回调中写入笔记；返回Future，结果与 process_image 相同（需要 AsyncGeminiHandler）"""
+        return self._submit_traced(trace or Trace('image'), self._submit_image, image, report)
+
+    def submit_text(self, text, report=_ignore_progress, trace=None):
+        """异步请求模式下处理文本，返回Future，结果与 process_text 相同（需要 AsyncGeminiHandler）"""
+        return self._submit_traced(trace or Trace('text'), self._submit_text, text, report)
+
+    def _submit_traced(self, trace, func, *args):
+        """在Trace上下文中提交处理流程，返回的Future完成后记录性能数据"""
+        try:
+            with trace.activate():
+                future = func(*args)
+        except Exception as e:
+            trace.error = str(e)
+            if self.metrics:
+                self.metrics.record(trace)
+            raise
+
+        def record(future):
+            if future.exception() is not None:
+                trace.error = str(future.exception())
+            if self.metrics:
+                self.metrics.record(trace)
+
+        future.add_done_callback(record)
+        return future
+
+    def _submit_image(self, image, report):
+        trace = current_trace()
+
+        with trace.span('image.decode'):
+            max_edge = self.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+
+        try:
+            # 查找内容相同的图片，命中时直接复用已有笔记
+            image_hash = digest = None
+            if self.image_index:
+                with trace.span('image.dedup'):
+                    image_hash, digest = dhash(analysis_image), image_digest(analysis_image)
+                    duplicate = self.find_duplicate_note(image_hash, digest)
+                if duplicate:
+                    return _completed(duplicate)
+
+            report("正在保存图片...")
+            with trace.span('image.save'):
+                save_info = self.image_processor.save_image(image)
+            trace.add('image.encode', save_info['encode_ms'])
+            if self.image_index:
+                self.image_index.add(os.path.basename(save_info['image_path']), image_hash, digest)
+
+            prompt_hash = self.gemini.prompt_fingerprint('image')
+            cache_key = image_cache_key(analysis_image, prompt_hash)
+            journal_id = self.journal.record('image', save_info) if self.journal else None
+            try:
+                # 编码后即可释放分析用图片，等待分析时只保留上传数据
+                upload = None
+                analysis = self.image_cache.get(cache_key) if self.image_cache else None
+                if not analysis:
+                    with trace.span('image.encode_upload'):
+                        upload = self.gemini.prepare_image(analysis_image)
+            except Exception as e:
+                if journal_id is not None:
+                    self.journal.fail(journal_id, str(e))
+                raise
+        finally:
+            if analysis_image is not image:
+                analysis_image.close()
+
+        if analysis:
+            report("已命中分析缓存")
+            return self._finish_journaled(
+                journal_id, _completed(analysis),
+                lambda analysis: self._write_image_note(save_info, analysis, prompt_hash, 0)
+            )
+
+        def write_note(analysis):
+            if self.image_cache:
+                self.image_cache.put(cache_key, analysis)
+            return self._write_image_note(save_info, analysis, prompt_hash, len(upload['data']))
+
+        report(f"正在分析图片（上传 {len(upload['data']) / 1024:.0f} KB）...")
+        return self._finish_journaled(journal_id, self.gemini.submit_image(upload), write_note, 'image.analyze')
+
+    def _submit_text(self, text, report):
+        trace = current_trace()
+
+        report("正在处理文本...")
+        with trace.span('text.source'):
+            title = self.text_processor.process_source(text, self.text_processor.source_dir)
+
+        prompt_hash = self.gemini.prompt_fingerprint('markdown')
+        cache_key = text_cache_key(text, prompt_hash)
+        journal_id = self.journal.record('text', {'text': text, 'title': title}) if self.journal else None
+
+        analysis = self.text_cache.get(cache_key) if self.text_cache else None
+        if analysis:
+            report("已命中分析缓存")
+            return self._finish_journaled(
+                journal_id, _completed(analysis),
+                lambda analysis: self._write_text_note(title, analysis, prompt_hash)
+            )
+
+        def write_note(analysis):
+            if self.text_cache:
+                self.text_cache.put(cache_key, analysis)
+            return self._write_text_note(title, analysis, prompt_hash)
+
+        report("正在分析文本...")
+        return self._finish_journaled(journal_id, self.gemini.submit_text(text), write_note, 'text.analyze')
+
+    def get_note_writer(self):
+        """返回写入笔记的线程池，异步模式下分析完成后在其中写入笔记；流程关闭后返回None"""
+        with self._note_writer_lock:
+            if self._note_writer is None and not self._closed:
+                self._note_writer = ThreadPoolExecutor(
+                    max_workers=config.PIPELINE_WORKERS, thread_name_prefix="NoteWriter"
+                )
+            return self._note_writer
+
+    def _finish_journaled(self, journal_id, analysis_future, write_note, stage=None):
+        """分析完成后在当前Trace上下文中写入笔记并更新日志，返回处理结果的Future"""
+        result = Future()
+        context = contextvars.copy_context()
+        start = time.perf_counter()
+
+        def done(future):
+            # 回调在事件循环线程中执行，只记录耗时，写入文件和数据库交给写入线程
+            if stage:
+                context.run(lambda: current_trace().add(stage, (time.perf_counter() - start) * 1000))
+            note_writer = self.get_note_writer()
+            if note_writer is None:
+                finish(future)
+            else:
+                note_writer.submit(finish, future)
+
+        def finish(future):
+            try:
+                value = context.run(write_note, future.result())
+            except CancelledError as e:
+                # 程序退出时取消的分析留在日志中，下次启动时重放
+                if journal_id is not None:
+                    self.journal.release(journal_id)
+                result.set_exception(e)
+            except JobCancelled as e:
+                if journal_id is not None:
+                    self.journal.cancel(journal_id)
+                result.set_exception(e)
+            except Exception as e:
+                if journal_id is not None:
+                    self.journal.fail(journal_id, str(e))
+                result.set_exception(e)
+            else:
+                if journal_id is not None:
+                    self.journal.complete(journal_id)
+                result.set_result(value)
+
+        analysis_future.add_done_callback(done)
+        return result
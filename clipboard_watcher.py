@@ -0,0 +1,101 @@
+import hashlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# 计算内容哈希前缩小到的尺寸
+THUMBNAIL_SIZE = (32, 32)
+
+
+def clipboard_sequence_number():
+    """返回Windows剪贴板的序列号（内容每变化一次加一），其他平台返回None"""
+    if sys.platform != 'win32':
+        return None
+    import ctypes
+    return ctypes.windll.user32.GetClipboardSequenceNumber()
+
+
+def thumbnail_hash(image):
+    """缩小后像素的哈希，用于在没有序列号的平台上判断剪贴板图片是否变化"""
+    from PIL import Image
+
+    thumbnail = image.resize(THUMBNAIL_SIZE, Image.NEAREST)
+    return hashlib.md5(thumbnail.tobytes()).hexdigest()
+
+
+class ClipboardWatcher:
+    """在Tk主线程中定时检查剪贴板序列号，读取和比较内容在单独的线程中进行，出现新图片时在该线程中调用 on_image"""
+
+    def __init__(self, root, on_image, interval=1000):
+        self.root = root
+        self.on_image = on_image
+        self.interval = interval
+        self.executor = None
+        self._stopped = True
+        self._pending = None
+        # 启动前已在剪贴板中的内容不做预分析
+        self._last_sequence = clipboard_sequence_number()
+        self._last_hash = None
+        self._checked = False
+
+    def start(self):
+        """开始检查"""
+        self._stopped = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ClipboardGrab")
+        self.root.after(self.interval, self._poll)
+
+    def stop(self):
+        """停止检查"""
+        self._stopped = True
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        if self._stopped:
+            return
+        try:
+            self._check()
+        except Exception as e:
+            print(f"剪贴板检查失败: {str(e)}")
+        self.root.after(self.interval, self._poll)
+
+    def _check(self):
+        """检查剪贴板是否变化（Tk主线程），只有序列号比较在这里进行"""
+        # 上一次读取尚未完成时等到下一次检查
+        if self._pending is not None and not self._pending.done():
+            return
+
+        # Windows 下序列号不变时不读取剪贴板内容
+        sequence = clipboard_sequence_number()
+        if sequence is not None:
+            if sequence == self._last_sequence:
+                return
+            self._last_sequence = sequence
+
+        self._pending = self.executor.submit(self._grab, sequence)
+
+    def _grab(self, sequence):
+        """读取剪贴板并判断是否出现了新图片（在读取线程中执行）"""
+        try:
+            self._grab_image(sequence)
+        except Exception as e:
+            print(f"剪贴板检查失败: {str(e)}")
+
+    def _grab_image(self, sequence):
+        from PIL import Image, ImageGrab
+
+        content = ImageGrab.grabclipboard()
+        if not isinstance(content, Image.Image):
+            content = None
+
+        if sequence is None:
+            digest = thumbnail_hash(content) if content is not None else None
+            changed = self._checked and digest != self._last_hash
+            self._checked = True
+            self._last_hash = digest
+            if not changed:
+                if content is not None:
+                    content.close()
+                return
+
+        if content is not None:
+            self.on_image(content)
@@ -1,6 +1,7 @@
 import os
 import configparser
 import sys
+from urllib.parse import urlparse
 
 # 获取程序运行目录
 if getattr(sys, 'frozen', False):
@@ -32,6 +33,8 @@ except KeyError:
 # 子目录配置
 IMAGES_ASSETS_SUBDIR = "images"  # 图片保存目录
 SOURCE_SUBDIR = "source"  # 原始文本保存目录
+DATA_SUBDIR = ".tagsnap"  # 缓存等内部数据目录
+ORIGINAL_SUBDIR = "originals"  # 内部数据目录下保存粘贴原文的目录，重新分析时使用
 
 # 代理配置
 PROXY_CONFIG = {
@@ -43,22 +46,85 @@ PROXY_CONFIG = {
 WINDOW_SIZE = "800x600"
 LABEL_FONT = ('Microsoft YaHei', 10)
 DISPLAY_RATIO = 0.62  # 显示区域占窗口的比例
+RESIZE_DEBOUNCE_MS = 150  # 窗口大小停止变化多久后做清晰渲染（毫秒）
+
+# 后台任务配置
+PIPELINE_WORKERS = config.getint('pipeline', 'workers', fallback=2)  # 后台处理线程数
+QUEUE_POLL_INTERVAL = 100  # 主线程轮询任务结果的间隔（毫秒）
+SHUTDOWN_TIMEOUT = 10  # 退出时等待正在执行的任务结束的最长时间（秒）
+BATCH_WORKERS = config.getint('batch', 'workers', fallback=4)  # 多图粘贴时同时保存的图片数
+BATCH_INDEX_NOTE = config.getboolean('batch', 'index_note', fallback=True)  # 是否为多图粘贴生成索引笔记
+GEMINI_ASYNC = config.getboolean('gemini', 'async_requests', fallback=False)  # 模型请求在单独的事件循环线程中异步执行
+
+# 图片存储配置
+# image_format 可选 auto/png/webp_lossless/webp/jpeg，auto 时截图类图片用无损格式，照片用有损格式
+STORAGE_FORMAT_NAMES = ('png', 'webp_lossless', 'webp', 'jpeg')  # 与 image_processor.STORAGE_FORMATS 一致
+IMAGE_FORMAT = config.get('storage', 'image_format', fallback='auto').strip().lower()
+AUTO_LOSSLESS_FORMAT = config.get('storage', 'auto_lossless_format', fallback='png').strip().lower()
+AUTO_LOSSY_FORMAT = config.get('storage', 'auto_lossy_format', fallback='jpeg').strip().lower()
+for _key, _value, _allowed in (
+    ('image_format', IMAGE_FORMAT, ('auto',) + STORAGE_FORMAT_NAMES),
+    ('auto_lossless_format', AUTO_LOSSLESS_FORMAT, STORAGE_FORMAT_NAMES),
+    ('auto_lossy_format', AUTO_LOSSY_FORMAT, STORAGE_FORMAT_NAMES),
+):
+    if _value not in _allowed:
+        raise ValueError(f"config.ini 文件 [storage] 节中的 {_key} = {_value} 无效，可选值为 {'/'.join(_allowed)}")
+PNG_COMPRESS_LEVEL = config.getint('storage', 'png_compress_level', fallback=6)
+LOSSY_QUALITY = config.getint('storage', 'quality', fallback=90)
+ENCODE_WORKERS = config.getint('storage', 'encode_workers', fallback=2)  # 为0时在当前线程编码
+
+# 分析结果缓存配置
+CACHE_ENABLED = config.getboolean('cache', 'enabled', fallback=True)
+CACHE_MAX_ENTRIES = config.getint('cache', 'max_entries', fallback=5000)
+CACHE_MAX_AGE_DAYS = config.getint('cache', 'max_age_days', fallback=180)
+
+# 相似图片去重配置
+DEDUP_ENABLED = config.getboolean('dedup', 'enabled', fallback=True)
+DEDUP_MAX_DISTANCE = config.getint('dedup', 'max_distance', fallback=10)  # 256位dHash的汉明距离阈值，只用于筛选候选图片
+
+# 剪贴板预分析配置：剪贴板出现新图片时提前分析，粘贴时直接使用结果（会消耗未被粘贴内容的请求配额）
+CLIPBOARD_WATCH_ENABLED = config.getboolean('clipboard_watch', 'enabled', fallback=False)
+CLIPBOARD_WATCH_INTERVAL = config.getint('clipboard_watch', 'interval_ms', fallback=1000)  # 检查间隔（毫秒）
+SPECULATION_TTL = config.getint('clipboard_watch', 'ttl_seconds', fallback=300)  # 未被粘贴的结果保留时间（秒）
+
+# 捕获日志配置：网络请求之前记录每次捕获，失败的捕获在启动时或网络恢复后重放
+JOURNAL_ENABLED = config.getboolean('journal', 'enabled', fallback=True)
+JOURNAL_REPLAY_INTERVAL = config.getint('journal', 'replay_interval', fallback=60)  # 检查网络并重放的间隔（秒）
+JOURNAL_MAX_ATTEMPTS = config.getint('journal', 'max_attempts', fallback=10)  # 超过后不再重放
+
+# 性能统计配置
+METRICS_ENABLED = config.getboolean('metrics', 'enabled', fallback=True)
+METRICS_LOG_MAX_BYTES = config.getint('metrics', 'log_max_bytes', fallback=5 * 1024 * 1024)
+METRICS_LOG_BACKUPS = config.getint('metrics', 'log_backups', fallback=3)
+METRICS_PROMETHEUS_PATH = config.get('metrics', 'prometheus_textfile', fallback='')  # 为空时不输出
+
+# 内存报告配置
+MEMORY_TRACEMALLOC = config.getboolean('memory', 'tracemalloc', fallback=False)  # 启动时即跟踪Python内存分配
 
 # 快捷键配置
 SHOW_WINDOW_HOTKEY = 'ctrl+shift+z'
 
 # 文件类型配置
-VALID_IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif']
+VALID_IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp']
 
 def setup_proxy():
     """设置代理"""
     os.environ["http_proxy"] = PROXY_CONFIG["http"]
     os.environ["https_proxy"] = PROXY_CONFIG["https"]
 
+def get_proxy_address():
+    """返回代理的 (主机, 端口)，用于检测网络是否恢复"""
+    parsed = urlparse(PROXY_CONFIG["https"])
+    return parsed.hostname, parsed.port
+
 def get_image_save_path():
     """获取图片保存路径"""
     return os.path.join(IMAGE_NOTE_PATH, IMAGES_ASSETS_SUBDIR)
 
+def get_data_path(note_dir, filename):
+    """获取笔记目录下内部数据文件的路径"""
+    return os.path.join(note_dir, DATA_SUBDIR, filename)
+
 def ensure_directories():
     """确保必要的目录存在"""
     # 图片相关目录
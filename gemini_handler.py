@@ -1,7 +1,27 @@
 import os
+import json
+import hashlib
 import configparser
-import google.generativeai as genai
 import sys
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict
+
+from task_graph import TaskGraph
+from image_encoder import encode_for_upload
+from rate_limiter import RateLimiter, estimate_tokens
+from text_chunker import split_markdown
+from job_queue import JobCancelled, raise_if_cancelled
+import metrics
+
+class CombinedAnalysis(TypedDict):
+    """合并分析模式下模型返回的JSON结构"""
+    summary: str
+    category: str
+    tags: list[str]
+
 
 class GeminiHandler:
     def __init__(self):
@@ -30,71 +50,396 @@ class GeminiHandler:
         self.prompts.read(prompt_path, encoding='utf-8')
         
         try:
-            api_key = config['gemini']['api_key']
+            self.api_key = config['gemini']['api_key']
         except KeyError:
             raise KeyError("请在 config.ini 文件的 [gemini] 节中配置 api_key")
             
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
-        self._initialize_model()
-        
-    def _initialize_model(self):
-        """初始化模型并设置基础prompt"""
-        response = self.model.generate_content(
-            self.prompts['gemini']['initial_prompt']
+        # 分析模式：separate 为逐项分析，combined 为单次请求返回JSON
+        self.analysis_mode = config.get('gemini', 'analysis_mode', fallback='separate').strip().lower()
+        if self.analysis_mode == 'combined' and not self.prompts.has_section('combined'):
+            print("prompt.ini 中缺少 [combined] 节，已切换为逐项分析模式")
+            self.analysis_mode = 'separate'
+        
+        # 同时进行的模型请求数上限
+        max_concurrency = config.getint('gemini', 'max_concurrency', fallback=4)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="Gemini")
+        # 异步请求模式下同时进行的模型请求数上限，请求在事件循环中等待不占用线程
+        self.max_in_flight = config.getint('gemini', 'max_in_flight', fallback=32)
+        
+        # 所有模型请求共用的限流器
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=config.getint('rate_limit', 'requests_per_minute', fallback=15),
+            tokens_per_minute=config.getint('rate_limit', 'tokens_per_minute', fallback=1000000),
+            max_retries=config.getint('rate_limit', 'max_retries', fallback=5),
+            base_delay=config.getfloat('rate_limit', 'base_delay', fallback=2.0),
+            max_delay=config.getfloat('rate_limit', 'max_delay', fallback=60.0)
         )
-        print(response.text)
         
+        # 上传图片的预处理参数
+        self.upload_max_edge = config.getint('upload', 'max_edge', fallback=2048)
+        self.upload_format = config.get('upload', 'format', fallback='JPEG')
+        self.upload_quality = config.getint('upload', 'quality', fallback=85)
+        
+        # 超过阈值的长文本按标题分块摘要后再合并
+        self.long_text_threshold = config.getint('long_text', 'threshold_tokens', fallback=30000)
+        self.long_text_chunk_tokens = config.getint('long_text', 'chunk_tokens', fallback=8000)
+        
+        # 显式上下文缓存：系统指令和示例只上传一次，之后的请求引用缓存
+        self.context_cache_enabled = config.getboolean('context_cache', 'enabled', fallback=True)
+        self.context_cache_ttl = config.getint('context_cache', 'ttl_seconds', fallback=1800)
+        self.context_cache_min_tokens = config.getint('context_cache', 'min_tokens', fallback=4096)
+        
+        # 模型客户端在首次请求时才创建，避免拖慢启动
+        self.model_name = config.get('gemini', 'model', fallback='gemini-2.0-flash')
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = None
+        self._cache_refresh_at = 0
+        self._closed = False
+        
+    @property
+    def model(self):
+        """延迟创建模型客户端，角色设定通过 system_instruction 或上下文缓存随每次请求生效"""
+        if self._model is None or (self._cache is not None and time.time() >= self._cache_refresh_at):
+            with self._model_lock:
+                if self._closed:
+                    # 关闭后仍在进行的请求不再创建模型，否则新建的上下文缓存不会被删除
+                    raise RuntimeError("模型客户端已关闭")
+                if self._model is None:
+                    self._model = self._create_model()
+                elif self._cache is not None and time.time() >= self._cache_refresh_at:
+                    self._refresh_cache()
+        return self._model
+        
+    @property
+    def few_shot_examples(self):
+        """prompt.ini 中可选的 [examples] 节，每项为一个示例"""
+        if not self.prompts.has_section('examples'):
+            return ''
+        return '\n\n'.join(value.strip() for value in self.prompts['examples'].values() if value.strip())
+        
+    def _create_model(self):
+        """创建模型客户端，能使用上下文缓存时从缓存创建"""
+        import google.generativeai as genai
+        
+        genai.configure(api_key=self.api_key)
+        system_instruction = self.prompts['gemini']['initial_prompt']
+        examples = self.few_shot_examples
+        
+        if self.context_cache_enabled:
+            model = self._create_cached_model(genai, system_instruction, examples)
+            if model is not None:
+                return model
+        
+        # 不使用缓存时示例并入系统指令，保证两种方式下模型看到的内容一致
+        if examples:
+            system_instruction = f"{system_instruction}\n\n{examples}"
+        return genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+        
+    def _create_cached_model(self, genai, system_instruction, examples):
+        """创建上下文缓存并返回引用它的模型，内容过短或模型不支持时返回None"""
+        # 缓存内容低于模型要求的最小token数时接口会拒绝，直接跳过
+        if estimate_tokens([system_instruction, examples]) < self.context_cache_min_tokens:
+            return None
+        
+        try:
+            from google.generativeai import caching
+            
+            self._cache = caching.CachedContent.create(
+                model=self.model_name,
+                display_name='tagsnap-prompts',
+                system_instruction=system_instruction,
+                contents=[examples] if examples else None,
+                ttl=datetime.timedelta(seconds=self.context_cache_ttl)
+            )
+            self._cache_refresh_at = time.time() + self.context_cache_ttl / 2
+            return genai.GenerativeModel.from_cached_content(cached_content=self._cache)
+        except Exception as e:
+            print(f"上下文缓存创建失败，改为直接发送系统指令: {str(e)}")
+            self._cache = None
+            return None
+        
+    def _refresh_cache(self):
+        """有效期过半时续期上下文缓存，续期失败（如已过期）时重新创建模型"""
+        try:
+            self._cache.update(ttl=datetime.timedelta(seconds=self.context_cache_ttl))
+            self._cache_refresh_at = time.time() + self.context_cache_ttl / 2
+        except Exception as e:
+            print(f"上下文缓存续期失败，重新创建: {str(e)}")
+            self._cache = None
+            self._model = self._create_model()
+        
+    def generate_content(self, contents, stage='gemini', on_chunk=None, **kwargs):
+        """经过限流和失败重试的模型请求，耗时和token用量记录到当前Trace"""
+        # 传入 on_chunk 时流式请求，每收到一段文本调用一次；重试前会先调用 on_chunk(None)
+        if on_chunk is None:
+            def request():
+                # 任务已取消时不再发送尚未开始的请求（包括限流等待或重试之后）
+                raise_if_cancelled()
+                return self.model.generate_content(contents, **kwargs)
+        else:
+            request = self._stream_request(contents, stage, on_chunk, **kwargs)
+        
+        with metrics.span(stage):
+            response = self.rate_limiter.call(request, estimate_tokens(contents))
+        trace = metrics.current_trace()
+        if trace:
+            trace.add_tokens(getattr(response, 'usage_metadata', None))
+        return response
+
+    def _stream_request(self, contents, stage, on_chunk, **kwargs):
+        """生成一次流式请求的执行函数，返回读取完毕的响应"""
+        emitted = False
+        
+        def request():
+            nonlocal emitted
+            if emitted:
+                on_chunk(None)
+                emitted = False
+            
+            raise_if_cancelled()
+            start = time.perf_counter()
+            response = self.model.generate_content(contents, stream=True, **kwargs)
+            for chunk in response:
+                # 取消后不再读取剩余的流式结果
+                raise_if_cancelled()
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # 只包含结束原因等信息、没有文本的分段
+                    continue
+                if not text:
+                    continue
+                if not emitted:
+                    trace = metrics.current_trace()
+                    if trace:
+                        trace.add(f"{stage}.first_chunk", (time.perf_counter() - start) * 1000)
+                    emitted = True
+                on_chunk(text)
+            return response
+        
+        return request
+
+    def close(self):
+        """关闭模型请求线程池，并删除本次运行创建的上下文缓存（否则会一直计费到过期）"""
+        self.executor.shutdown(wait=False)
+        with self._model_lock:
+            self._closed = True
+            cache, self._cache = self._cache, None
+            self._model = None
+        if cache is not None:
+            try:
+                cache.delete()
+            except Exception as e:
+                print(f"上下文缓存删除失败: {str(e)}")
+
+    def prompt_fingerprint(self, kind):
+        """计算模型与prompt配置的哈希，kind 为 image 或 markdown"""
+        combined_key = 'image_prompt' if kind == 'image' else 'markdown_prompt'
+        parts = [
+            self.model_name,
+            self.analysis_mode,
+            self.prompts['gemini']['initial_prompt'],
+            *(f"{key}={value}" for key, value in sorted(self.prompts[kind].items())),
+        ]
+        if self.analysis_mode == 'combined':
+            parts.append(self.prompts['combined'][combined_key])
+        if self.few_shot_examples:
+            parts.append(self.few_shot_examples)
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+    def prepare_image(self, image):
+        """将图片缩放并编码一次，返回所有请求共用的blob"""
+        return encode_for_upload(
+            image,
+            max_edge=self.upload_max_edge,
+            image_format=self.upload_format,
+            quality=self.upload_quality
+        )
+
     def analyze_image(self, image):
-        """分析图片内容"""
-        summary = self.image_summary_analyze(image)
-        category = self.image_category_judge(image)
-        tags = self.image_tag_analyze(summary.text)
+        """分析图片内容（描述与分类并发执行，标签依赖描述）"""
+        # 只编码一次，所有请求复用同一份数据
+        if not isinstance(image, dict):
+            image = self.prepare_image(image)
+        
+        if self.analysis_mode == 'combined':
+            result = self.combined_analyze(self.prompts['combined']['image_prompt'], image)
+            if result:
+                return result
+        
+        graph = TaskGraph(self.executor)
+        graph.add('summary', lambda: self.image_summary_analyze(image).text)
+        graph.add('category', lambda: self.image_category_judge(image).text)
+        graph.add('tags', lambda summary: self.image_tag_analyze(summary).text, 'summary')
+        results = graph.run()
+        
+        return {
+            'summary': results['summary'],
+            'category': results['category'],
+            'tags': results['tags']
+        }
+
+    def count_text_tokens(self, md_text):
+        """统计文本的token数，只有估算值接近阈值时才调用接口精确计数"""
+        estimate = estimate_tokens(md_text)
+        if not self.long_text_threshold // 2 <= estimate <= self.long_text_threshold * 2:
+            return estimate
+        try:
+            with metrics.span('gemini.count_tokens'):
+                return self.model.count_tokens(md_text).total_tokens
+        except Exception as e:
+            print(f"token计数失败，使用估算值: {str(e)}")
+            return estimate
+
+    def analyze_text(self, md_text, on_summary_chunk=None):
+        """分析文本内容（分类、摘要、标签三者并发执行），on_summary_chunk 用于流式接收摘要"""
+        if self.count_text_tokens(md_text) > self.long_text_threshold:
+            return self.analyze_long_text(md_text, on_summary_chunk)
+        
+        if self.analysis_mode == 'combined':
+            result = self.combined_analyze(self.prompts['combined']['markdown_prompt'], md_text)
+            if result:
+                return result
+        
+        graph = TaskGraph(self.executor)
+        graph.add('category', lambda: self.md_category_judge(md_text).text)
+        graph.add('summary', lambda: self.md_summary_analyze(md_text, on_summary_chunk).text)
+        graph.add('tags', lambda: self.md_tag_analyze(md_text).text)
+        results = graph.run()
+        
+        return {
+            'summary': results['summary'],
+            'category': results['category'],
+            'tags': results['tags']
+        }
+
+    def analyze_long_text(self, md_text, on_summary_chunk=None):
+        """长文本分块并发摘要后合并，分类和标签基于合并后的摘要"""
+        chunks = split_markdown(md_text, self.long_text_chunk_tokens)
+        summaries = self._map_chunks(self.md_chunk_summary_analyze, chunks)
+        
+        # 分块摘要合起来仍然过长时先分组合并，直到一次请求能放下
+        while len(summaries) > 1 and estimate_tokens(summaries) > self.long_text_chunk_tokens:
+            groups = split_markdown('\n\n'.join(summaries), self.long_text_chunk_tokens)
+            if len(groups) >= len(summaries):
+                break
+            summaries = self._map_chunks(self.md_reduce_analyze, groups)
+        
+        graph = TaskGraph(self.executor)
+        graph.add('summary', lambda: self.md_reduce_analyze('\n\n'.join(summaries), on_summary_chunk).text)
+        graph.add('category', lambda summary: self.md_category_judge(summary).text, 'summary')
+        graph.add('tags', lambda summary: self.md_tag_analyze(summary).text, 'summary')
+        results = graph.run()
         
         return {
-            'summary': summary.text,
-            'category': category.text,
-            'tags': tags.text
+            'summary': results['summary'],
+            'category': results['category'],
+            'tags': results['tags']
         }
 
-    def image_summary_analyze(self, image):
+    def _map_chunks(self, analyze, chunks):
+        """并发分析各个分块，按原顺序返回结果文本"""
+        graph = TaskGraph(self.executor)
+        for i, chunk in enumerate(chunks):
+            graph.add(f"chunk_{i}", lambda chunk=chunk: analyze(chunk).text)
+        results = graph.run()
+        return [results[f"chunk_{i}"] for i in range(len(chunks))]
+
+    def combined_analyze(self, prompt, content):
+        """单次请求同时获取描述、分类和标签，解析失败时返回None"""
+        try:
+            response = self.generate_content(
+                [prompt, content],
+                stage='gemini.combined',
+                generation_config={
+                    'response_mime_type': "application/json",
+                    'response_schema': CombinedAnalysis
+                }
+            )
+            return self._parse_combined_result(response.text)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"合并分析失败，改用逐项分析: {str(e)}")
+            return None
+
+    @staticmethod
+    def _parse_combined_result(text):
+        """校验并规范化合并分析的JSON结果"""
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("返回结果不是JSON对象")
+        
+        summary = data.get('summary')
+        category = data.get('category')
+        tags = data.get('tags')
+        
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError("缺少 summary 字段")
+        if not isinstance(category, str) or not category.strip():
+            raise ValueError("缺少 category 字段")
+        
+        # 标签统一为空格分隔的字符串，与逐项分析的格式一致
+        if isinstance(tags, list):
+            tags = ' '.join(str(tag).strip() for tag in tags if str(tag).strip())
+        if not isinstance(tags, str) or not tags.strip():
+            raise ValueError("缺少 tags 字段")
+        
+        return {
+            'summary': summary.strip(),
+            'category': category.strip(),
+            'tags': tags.strip()
+        }
+
+    def image_summary_analyze(self, image, on_chunk=None):
         """获取图片描述"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['image']['summary_prompt'], 
             image
-        ])
+        ], stage='gemini.image_summary', on_chunk=on_chunk)
 
     def image_tag_analyze(self, image_summary):
         """分析图片标签"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['image']['tag_prompt'], 
             image_summary
-        ])
+        ], stage='gemini.image_tags')
 
     def image_category_judge(self, image):
         """判断图片类别"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['image']['category_prompt'], 
             image
-        ]) 
+        ], stage='gemini.image_category') 
     
     def md_category_judge(self, md_text):
         """判断文本类别"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['markdown']['category_prompt'], 
             md_text
-        ])
+        ], stage='gemini.md_category')
     
-    def md_summary_analyze(self, md_text):
+    def md_summary_analyze(self, md_text, on_chunk=None):
         """获取文本描述"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['markdown']['summary_prompt'], 
             md_text
-        ])
+        ], stage='gemini.md_summary', on_chunk=on_chunk)
+    
+    def md_chunk_summary_analyze(self, chunk):
+        """获取长文本中一个分块的摘要"""
+        prompt = self.prompts['markdown'].get('chunk_summary_prompt', self.prompts['markdown']['summary_prompt'])
+        return self.generate_content([prompt, chunk], stage='gemini.md_chunk_summary')
+    
+    def md_reduce_analyze(self, summaries, on_chunk=None):
+        """将多个分块摘要合并为完整的文本描述"""
+        prompt = self.prompts['markdown'].get('reduce_prompt', self.prompts['markdown']['summary_prompt'])
+        return self.generate_content([prompt, summaries], stage='gemini.md_reduce', on_chunk=on_chunk)
     
     def md_tag_analyze(self, md_text):
         """分析文本标签"""
-        return self.model.generate_content([
+        return self.generate_content([
             self.prompts['markdown']['tag_prompt'], 
             md_text
-        ])
\ No newline at end of file
+        ], stage='gemini.md_tags')
\ No newline at end of file
@@ -0,0 +1,47 @@
+import io
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+def encode_for_upload(image, max_edge=2048, image_format='JPEG', quality=85):
+    """将图片缩放到长边不超过 max_edge 并编码一次，返回可直接传给模型的blob"""
+    from PIL import Image
+
+    image_format = image_format.upper()
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"不支持的上传格式: {image_format}")
+
+    # 统一颜色模式，JPEG不支持透明通道，透明区域铺白底
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        if image_format == 'JPEG':
+            converted = Image.new('RGB', rgba.size, 'white')
+            converted.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            converted = rgba
+    elif image.mode != 'RGB':
+        converted = image.convert('RGB')
+    else:
+        converted = image
+
+    # 限制长边，保留足够分辨率以识别图中文字
+    width, height = converted.size
+    scale = max_edge / max(width, height)
+    if scale < 1:
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        converted = converted.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+    buffer = io.BytesIO()
+    if image_format == 'PNG':
+        converted.save(buffer, format='PNG')
+    else:
+        converted.save(buffer, format=image_format, quality=quality)
+
+    return {
+        'mime_type': MIME_TYPES[image_format],
+        'data': buffer.getvalue()
+    }
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+
+
+def dhash(image, hash_size=16):
+    """计算图片的差值哈希（dHash），返回 hash_size*hash_size 位整数"""
+    from PIL import Image
+
+    gray = image.convert('L')
+
+    # 大图先用reduce快速缩小，再做精确缩放
+    factor = min(gray.size) // (hash_size * 16)
+    if factor > 1:
+        gray = gray.reduce(factor)
+
+    pixels = gray.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR).tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """计算两个哈希值之间的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """按汉明距离组织的BK树，用于快速查找相似哈希"""
+
+    def __init__(self):
+        self._root = None
+
+    def add(self, value, item):
+        """插入哈希值及其关联对象"""
+        node = [value, [item], {}]
+        if self._root is None:
+            self._root = node
+            return
+
+        current = self._root
+        while True:
+            distance = hamming_distance(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """返回距离不超过 max_distance 的 (距离, 对象) 列表，按距离升序"""
+        if self._root is None:
+            return []
+
+        results = []
+        candidates = [self._root]
+        while candidates:
+            node = candidates.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # 三角不等式剪枝：只需检查距离在 [d-k, d+k] 范围内的子树
+            low, high = distance - max_distance, distance + max_distance
+            candidates.extend(child for key, child in node[2].items() if low <= key <= high)
+
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class ImageIndex:
+    """图片目录的感知哈希索引，哈希值持久化在SQLite中，查询使用内存中的BK树
+
+    感知哈希只用于找出候选图片，文字截图之间的哈希往往很接近，
+    候选图片的内容摘要与新图片完全一致时才视为重复"""
+
+    def __init__(self, images_dir, db_path, max_distance=10, hash_size=16, file_digest=None):
+        self.images_dir = images_dir
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.file_digest = file_digest  # 计算已有图片文件的内容摘要，用于确认候选图片
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._hashes = {}
+        self._digests = {}
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_hash (
+                filename TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                digest TEXT
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(image_hash)")]
+        if 'digest' not in columns:
+            self._conn.execute("ALTER TABLE image_hash ADD COLUMN digest TEXT")
+
+        # 哈希位数不同的旧索引作废，由 sync() 重新计算
+        hex_length = hash_size * hash_size // 4
+        self._conn.execute("DELETE FROM image_hash WHERE length(hash) != ?", (hex_length,))
+        self._conn.commit()
+
+        # 载入已有索引
+        for filename, value, digest in self._conn.execute("SELECT filename, hash, digest FROM image_hash"):
+            value = int(value, 16)
+            self._hashes[filename] = value
+            self._digests[filename] = digest
+            self._tree.add(value, filename)
+
+    def find(self, value, digest):
+        """查找与给定哈希相近且内容摘要相同的已有图片文件名，没有则返回None"""
+        with self._lock:
+            candidates = [filename for _, filename in self._tree.search(value, self.max_distance)
+                          if filename in self._hashes]
+
+        for filename in candidates:
+            # 跳过已被删除的图片
+            path = os.path.join(self.images_dir, filename)
+            if not os.path.exists(path):
+                continue
+            if self._candidate_digest(filename, path) == digest:
+                return filename
+        return None
+
+    def _candidate_digest(self, filename, path):
+        """返回候选图片的内容摘要，同步得到的索引没有摘要时读取文件计算并保存"""
+        candidate = self._digests.get(filename)
+        if candidate is not None or self.file_digest is None:
+            return candidate
+        try:
+            candidate = self.file_digest(path)
+        except Exception:
+            return None
+        with self._lock:
+            if filename in self._hashes:
+                self._digests[filename] = candidate
+                self._conn.execute("UPDATE image_hash SET digest = ? WHERE filename = ?", (candidate, filename))
+                self._conn.commit()
+        return candidate
+
+    def add(self, filename, value, digest=None):
+        """将图片加入索引，digest 为图片的内容摘要"""
+        with self._lock:
+            if filename in self._hashes:
+                return
+            self._hashes[filename] = value
+            self._digests[filename] = digest
+            self._tree.add(value, filename)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_hash (filename, hash, digest) VALUES (?, ?, ?)",
+                (filename, f"{value:0{self.hash_size * self.hash_size // 4}x}", digest)
+            )
+            self._conn.commit()
+
+    def remove(self, filename):
+        """将图片移出索引（BK树中的节点保留，查找时会跳过已删除的文件）"""
+        with self._lock:
+            if self._hashes.pop(filename, None) is None:
+                return
+            self._digests.pop(filename, None)
+            self._conn.execute("DELETE FROM image_hash WHERE filename = ?", (filename,))
+            self._conn.commit()
+
+    def sync(self):
+        """为图片目录中尚未建立索引的图片计算哈希，内容摘要在成为候选时才计算"""
+        from PIL import Image
+
+        for entry in os.scandir(self.images_dir):
+            if not entry.is_file() or entry.name in self._hashes:
+                continue
+            try:
+                with Image.open(entry.path) as image:
+                    # JPEG直接按缩小尺寸解码
+                    image.draft('L', (128, 128))
+                    value = dhash(image, self.hash_size)
+            except Exception:
+                continue
+            self.add(entry.name, value)
+
+    def start_sync(self):
+        """在后台线程中同步图片目录"""
+        thread = threading.Thread(target=self.sync, name="ImageIndexSync", daemon=True)
+        thread.start()
+        return thread
@@ -1,43 +1,245 @@
 import os
+import sys
 import time
+import shutil
+import threading
 import uuid
 import datetime
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+
+# 存储格式：(PIL格式名, 扩展名, 保存参数)
+STORAGE_FORMATS = {
+    'png': ('PNG', 'png', lambda: {'compress_level': config.PNG_COMPRESS_LEVEL}),
+    'webp_lossless': ('WEBP', 'webp', lambda: {'lossless': True, 'method': 4}),
+    'webp': ('WEBP', 'webp', lambda: {'quality': config.LOSSY_QUALITY, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', lambda: {'quality': config.LOSSY_QUALITY, 'optimize': True}),
+}
+
+# 来自文件的图片若为以下格式，直接复制原文件而不重新编码：PIL格式名 -> (存储格式名, 扩展名)
+PASSTHROUGH_FORMATS = {
+    'PNG': ('png', 'png'),
+    'JPEG': ('jpeg', 'jpg'),
+    'GIF': ('gif', 'gif'),
+    'WEBP': ('webp', 'webp'),
+}
+
+# 缩略图中颜色数不超过该值时视为截图/图表等，使用无损格式
+GRAPHIC_MAX_COLORS = 2048
+
+
+def classify_image(image):
+    """粗略判断图片内容：graphic 为截图、图表等少色图片，photo 为照片"""
+    from PIL import Image
+
+    sample = image.copy()
+    sample.thumbnail((256, 256), Image.Resampling.NEAREST)
+    if sample.mode not in ('RGB', 'RGBA', 'L'):
+        sample = sample.convert('RGB')
+    colors = sample.getcolors(maxcolors=GRAPHIC_MAX_COLORS)
+    return 'graphic' if colors is not None else 'photo'
+
+
+def is_file_backed(image):
+    """图片是否直接来自磁盘文件（Image.open 打开且文件仍存在）"""
+    filename = getattr(image, 'filename', '')
+    return bool(filename) and os.path.isfile(filename)
+
+
+def open_reduced(image, box):
+    """得到缩放到 box 以内所需的最小解码结果：文件来源的JPEG用draft按1/2~1/8比例解码，其他图片原样返回"""
+    if not is_file_backed(image):
+        return image
+    
+    from PIL import Image
+
+    width, height = image.size
+    scale = min(box[0] / width, box[1] / height, 1)
+    reduced = Image.open(image.filename)
+    reduced.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+    reduced.load()
+    return reduced
+
+
+def copy_file(src, dst):
+    """按字节复制文件，优先使用 copy_file_range/sendfile 在内核中完成复制"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        
+        if offset < size and sys.platform.startswith('linux'):
+            try:
+                os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+                while offset < size:
+                    copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        
+        # 其他平台或内核复制失败时，从已复制的位置继续用普通读写完成
+        if offset < size:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def _encode_image(mode, size, data, image_path, pil_format, options):
+    """在子进程中编码并写入图片，返回 (文件字节数, 编码耗时毫秒)"""
+    from PIL import Image
+
+    start = time.perf_counter()
+    image = Image.frombytes(mode, size, data)
+    image.save(image_path, format=pil_format, **options)
+    return os.path.getsize(image_path), (time.perf_counter() - start) * 1000
+
 
 class ImageProcessor:
     def __init__(self, note_dir):
         self.note_dir = note_dir
         self.images_dir = os.path.join(note_dir, "images")
         os.makedirs(self.images_dir, exist_ok=True)
+        
+        # 编码进程池，首次保存时创建
+        self._encode_pool = None
+        self._encode_lock = threading.Lock()
+
+    def choose_format(self, image):
+        """根据配置和图片内容选择存储格式"""
+        if config.IMAGE_FORMAT != 'auto':
+            storage_format = config.IMAGE_FORMAT
+        elif classify_image(image) == 'graphic':
+            storage_format = config.AUTO_LOSSLESS_FORMAT
+        else:
+            storage_format = config.AUTO_LOSSY_FORMAT
+        
+        # JPEG不支持透明通道，改用有损WebP
+        if storage_format == 'jpeg' and image.mode in ('RGBA', 'LA', 'PA'):
+            storage_format = 'webp'
+        return storage_format
+
+    def encode_image(self, image, image_path, pil_format, options):
+        """在进程池中编码图片，避免长时间占用GIL；进程池不可用时在当前线程编码"""
+        # 统一为可直接传输原始像素的模式
+        if image.mode == 'P':
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGB')
+        if pil_format == 'JPEG' and image.mode == 'LA':
+            image = image.convert('L')
+        
+        if config.ENCODE_WORKERS > 0:
+            pool = None
+            try:
+                pool = self.get_encode_pool()
+                future = pool.submit(
+                    _encode_image, image.mode, image.size, image.tobytes(),
+                    image_path, pil_format, options
+                )
+                return future.result()
+            except (BrokenProcessPool, OSError) as e:
+                print(f"编码进程池不可用，改为在当前线程编码: {str(e)}")
+                if pool is not None:
+                    self.drop_encode_pool(pool)
+        
+        start = time.perf_counter()
+        image.save(image_path, format=pil_format, **options)
+        return os.path.getsize(image_path), (time.perf_counter() - start) * 1000
+
+    def get_encode_pool(self):
+        """返回编码进程池，多个线程同时首次保存时只创建一个"""
+        with self._encode_lock:
+            if self._encode_pool is None:
+                self._encode_pool = ProcessPoolExecutor(max_workers=config.ENCODE_WORKERS)
+            return self._encode_pool
+
+    def drop_encode_pool(self, pool):
+        """关闭已损坏的进程池，下次编码时重新创建"""
+        with self._encode_lock:
+            if self._encode_pool is pool:
+                self._encode_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def copy_source_file(self, image, img_filename):
+        """直接复制来源文件，不解码也不重新编码；扩展名按实际格式确定，不沿用可能有误的原文件名"""
+        ext = PASSTHROUGH_FORMATS[image.format][1]
+        image_path = os.path.join(self.images_dir, f"{img_filename}.{ext}")
+        
+        start = time.perf_counter()
+        copy_file(image.filename, image_path)
+        return image_path, os.path.getsize(image_path), (time.perf_counter() - start) * 1000
 
     def save_image(self, image):
         """保存图片并返回相关信息"""
         try:
+            # 已是可接受格式的文件直接复制
+            if is_file_backed(image) and image.format in PASSTHROUGH_FORMATS:
+                img_filename = f"image_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+                image_path, file_bytes, copy_ms = self.copy_source_file(image, img_filename)
+                return {
+                    'filename': img_filename,
+                    'image_path': image_path,
+                    'md_path': os.path.join(self.note_dir, f"{img_filename}.md"),
+                    'relative_path': f"images/{os.path.basename(image_path)}",
+                    'format': PASSTHROUGH_FORMATS[image.format][0],
+                    'bytes': file_bytes,
+                    'encode_ms': copy_ms
+                }
+            
+            # 选择存储格式
+            storage_format = self.choose_format(image)
+            pil_format, ext, options = STORAGE_FORMATS[storage_format]
+            
             # 生成唯一文件名
             img_filename = f"image_{int(time.time())}_{uuid.uuid4().hex[:6]}"
-            image_path = os.path.join(self.images_dir, f"{img_filename}.png")
+            image_path = os.path.join(self.images_dir, f"{img_filename}.{ext}")
             md_path = os.path.join(self.note_dir, f"{img_filename}.md")
             
             # 保存图片
-            image.save(image_path)
+            file_bytes, encode_ms = self.encode_image(image, image_path, pil_format, options())
             
             return {
                 'filename': img_filename,
                 'image_path': image_path,
                 'md_path': md_path,
-                'relative_path': f"images/{img_filename}.png"
+                'relative_path': f"images/{img_filename}.{ext}",
+                'format': storage_format,
+                'bytes': file_bytes,
+                'encode_ms': encode_ms
             }
         except Exception as e:
             raise Exception(f"图片保存失败: {str(e)}")
 
-    def create_md_file(self, md_path, image_path, category, tags, summary):
-        """创建markdown文件"""
+    def close(self):
+        """关闭编码进程池"""
+        with self._encode_lock:
+            pool, self._encode_pool = self._encode_pool, None
+        if pool:
+            pool.shutdown(wait=False)
+
+    def create_md_file(self, md_path, image_path, category, tags, summary, prompt_hash=None):
+        """创建markdown文件，prompt_hash 为生成时的prompt和模型版本"""
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
         
+        # 记录prompt和模型版本，prompt修改后可据此找出需要重新分析的笔记
+        version_line = f"\nprompt_hash: {prompt_hash}" if prompt_hash else ""
+        
         md_content = f"""---
 category: {category}
 tags: {tags}
-created: {current_date}
+created: {current_date}{version_line}
 ---
 ![[{image_path}]]
 {summary}"""
@@ -48,21 +250,73 @@ created: {current_date}
         except Exception as e:
             raise Exception(f"Markdown文件创建失败: {str(e)}")
 
-    def process_clipboard_image(self, clipboard_content):
-        """处理剪贴板图片内容"""
+    def read_md_file(self, md_path):
+        """读取已有markdown笔记中的分类、标签和描述，文件不存在时返回None"""
+        if not os.path.exists(md_path):
+            return None
+        
+        with open(md_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        
+        if not lines or lines[0] != '---' or '---' not in lines[1:]:
+            return None
+        end = lines.index('---', 1)
+        
+        # 解析元数据
+        metadata = {}
+        for line in lines[1:end]:
+            key, sep, value = line.partition(':')
+            if sep:
+                metadata[key.strip()] = value.strip()
+        
+        # 跳过图片引用行，其余为描述
+        body = lines[end + 1:]
+        if body and body[0].startswith('![['):
+            body = body[1:]
+        
+        return {
+            'category': metadata.get('category', ''),
+            'tags': metadata.get('tags', ''),
+            'summary': '\n'.join(body)
+        }
+
+    def create_index_file(self, md_path, entries):
+        """创建批量粘贴的索引笔记，entries 为 (笔记文件名, 分类) 列表"""
+        current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        links = '\n'.join(f"- [[{filename}]] {category}" for filename, category in entries)
+        
+        md_content = f"""---
+category: 批量导入
+created: {current_date}
+---
+{links}"""
+        
+        try:
+            with open(md_path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(md_content)
+        except Exception as e:
+            raise Exception(f"索引文件创建失败: {str(e)}")
+
+    def process_clipboard_images(self, clipboard_content):
+        """处理剪贴板图片内容，返回图片列表"""
+        from PIL import Image
+
         if isinstance(clipboard_content, list):
             return self._handle_file_paths(clipboard_content)
         elif isinstance(clipboard_content, Image.Image):
-            return clipboard_content
-        return None
+            return [clipboard_content]
+        return []
 
     def _handle_file_paths(self, file_list):
-        """处理文件路径列表（微信图片等）"""
-        valid_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.gif']
+        """处理文件路径列表（微信图片、文件管理器中复制的多个文件等）"""
+        from PIL import Image
+
+        images = []
         for path in file_list:
-            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in valid_extensions:
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in config.VALID_IMAGE_EXTENSIONS:
                 try:
-                    return Image.open(path)
+                    # 只读取文件头，像素在需要时才按所需尺寸解码
+                    images.append(Image.open(path))
                 except Exception:
                     continue
-        return None 
\ No newline at end of file
+        return images
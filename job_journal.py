@@ -0,0 +1,140 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+JournalEntry = namedtuple('JournalEntry', ['id', 'kind', 'payload', 'attempts'])
+
+
+def network_available(address, timeout=3):
+    """尝试建立TCP连接，判断代理或模型服务是否可达"""
+    try:
+        with socket.create_connection(address, timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class JobJournal:
+    """基于SQLite的预写日志：在任何网络请求之前记录捕获，完成后批量删除，未完成的可在重启或联网后重放"""
+
+    def __init__(self, db_path, max_attempts=10, flush_size=20, flush_interval=5.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # 本进程中正在处理的记录，重放时跳过
+        self._active = set()
+        # 已完成但尚未写入数据库的记录
+        self._done = []
+        self._last_flush = time.monotonic()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)")
+        self._conn.commit()
+
+    def record(self, kind, payload):
+        """记录一次捕获并立即提交，返回记录ID"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, payload, created, updated) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+            self._active.add(cursor.lastrowid)
+            return cursor.lastrowid
+
+    def complete(self, job_id):
+        """标记记录已完成，删除操作攒够一批或超过间隔时才写入数据库"""
+        with self._lock:
+            self._active.discard(job_id)
+            self._done.append(job_id)
+            if len(self._done) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def fail(self, job_id, error):
+        """记录一次失败，超过最大尝试次数后不再重放"""
+        with self._lock:
+            self._active.discard(job_id)
+            self._conn.execute(
+                """UPDATE jobs SET attempts = attempts + 1, last_error = ?, updated = ?,
+                   status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                   WHERE id = ?""",
+                (error, time.time(), self.max_attempts, job_id)
+            )
+            self._conn.commit()
+
+    def cancel(self, job_id):
+        """用户取消的捕获不再重放"""
+        with self._lock:
+            self._active.discard(job_id)
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ?", (time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def claim_pending(self):
+        """取出所有未完成且不在处理中的记录，并标记为处理中"""
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'pending' ORDER BY id"
+            ).fetchall()
+            entries = [
+                JournalEntry(job_id, kind, json.loads(payload), attempts)
+                for job_id, kind, payload, attempts in rows if job_id not in self._active
+            ]
+            self._active.update(entry.id for entry in entries)
+            return entries
+
+    def release(self, job_id):
+        """放回未处理的记录，留待下次重放"""
+        with self._lock:
+            self._active.discard(job_id)
+
+    def has_pending(self):
+        """是否有需要重放的记录"""
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = 'pending'").fetchall()
+            return any(job_id not in self._active for job_id, in rows)
+
+    def flush(self):
+        """立即写入已完成的记录"""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """写入已完成的记录并关闭数据库"""
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+    def _flush(self):
+        """在一个事务中删除已完成的记录（调用方需持有锁）"""
+        self._last_flush = time.monotonic()
+        if not self._done:
+            return
+        self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in self._done])
+        self._conn.commit()
+        self._done = []
@@ -0,0 +1,192 @@
+import contextvars
+import itertools
+import queue
+import threading
+import time
+
+# 当前工作线程正在执行的任务，TaskGraph提交任务时会复制上下文，模型请求线程也能取到
+_current_job = contextvars.ContextVar('tagsnap_job', default=None)
+
+# 任务优先级：当前显示内容的任务先于被取代的任务执行
+PRIORITY_FOREGROUND = 1
+PRIORITY_BACKGROUND = 0
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+def raise_if_cancelled():
+    """当前任务已被取消时抛出 JobCancelled，不在任务中执行时不做任何事"""
+    job = _current_job.get()
+    if job is not None and job.cancelled:
+        raise JobCancelled(f"任务 {job.id} 已取消")
+
+
+class Job:
+    def __init__(self, job_id, func, args, on_success=None, on_error=None, on_progress=None, priority=0,
+                 on_cancel=None):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel  # 开始前被取消时代替 func 调用，用于释放参数占用的资源
+        self.priority = priority
+        self.started = False
+        self.cancelled = False  # 尚未开始的模型请求不再发送
+        self.detached = False  # 任务继续执行，但回调不再在主线程中执行
+        self.done = False
+        self._queue = None
+
+    def cancel(self):
+        """取消任务：尚未开始的任务和模型请求不再执行，已有结果也不再回调"""
+        self.cancelled = True
+        self.detached = True
+
+    def detach(self):
+        """任务继续在后台执行完，但不再回调（用于被新任务取代的情况）"""
+        self.detached = True
+
+    def set_priority(self, priority):
+        """调整尚未开始的任务的优先级"""
+        if self._queue:
+            self._queue._reprioritize(self, priority)
+
+    def report(self, message):
+        """从工作线程发送进度消息，回调会在Tk主线程中执行"""
+        if self.on_progress and self._queue:
+            self._queue._post(self.on_progress, message, job=self)
+
+    def post(self, callback, *args):
+        """从工作线程提交任意回调到Tk主线程执行"""
+        if self._queue:
+            self._queue._post(callback, *args, job=self)
+
+
+class JobQueue:
+    """后台任务队列：工作线程按优先级执行耗时任务（同优先级时新任务优先），结果通过 root.after 轮询回到Tk主线程"""
+
+    def __init__(self, root, worker_count=2, poll_interval=100, on_depth_change=None):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.on_depth_change = on_depth_change
+
+        self._jobs = queue.PriorityQueue()
+        self._events = queue.Queue()
+        self._ids = itertools.count(1)
+        self._depth = 0
+        self._depth_lock = threading.Lock()
+        self._priority_lock = threading.Lock()
+        self._stopped = False
+
+        # 启动工作线程
+        self._workers = []
+        for i in range(max(1, worker_count)):
+            worker = threading.Thread(target=self._worker_loop, name=f"JobWorker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        # 开始轮询事件队列
+        self.root.after(self.poll_interval, self._poll)
+
+    @property
+    def depth(self):
+        """排队中和执行中的任务总数"""
+        with self._depth_lock:
+            return self._depth
+
+    def submit(self, func, *args, on_success=None, on_error=None, on_progress=None, priority=0, on_cancel=None):
+        """提交任务，func 和 on_cancel 的第一个参数为 Job 实例；priority 越大越先执行"""
+        job = Job(next(self._ids), func, args, on_success, on_error, on_progress, priority, on_cancel)
+        job._queue = self
+        self._change_depth(1)
+        self._jobs.put((-priority, -job.id, job))
+        return job
+
+    def _reprioritize(self, job, priority):
+        """以新的优先级重新排队，旧的条目在取出时跳过"""
+        with self._priority_lock:
+            if job.started or job.priority == priority:
+                return
+            job.priority = priority
+            self._jobs.put((-priority, -job.id, job))
+
+    def stop(self, timeout=None):
+        """停止所有工作线程，尚未开始的任务不再执行；timeout 不为None时最多等待这么多秒让正在执行的任务结束"""
+        self._stopped = True
+        for i in range(len(self._workers)):
+            self._jobs.put((float('-inf'), i, None))
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            for worker in self._workers:
+                worker.join(max(0, deadline - time.monotonic()))
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            priority, _, job = self._jobs.get()
+            if job is None:
+                break
+            with self._priority_lock:
+                # 调整过优先级的任务在队列中有多个条目，只执行与当前优先级一致的那个
+                if job.started or -priority != job.priority:
+                    continue
+                job.started = True
+            if job.cancelled:
+                # 任务不会执行，由 on_cancel 释放参数（如打开的图片文件）
+                if job.on_cancel:
+                    try:
+                        job.on_cancel(job, *job.args)
+                    except Exception as e:
+                        print(f"任务取消回调执行失败: {str(e)}")
+                job.done = True
+                self._change_depth(-1)
+                continue
+
+            token = _current_job.set(job)
+            try:
+                result = job.func(job, *job.args)
+            except JobCancelled:
+                pass
+            except Exception as e:
+                if job.on_error:
+                    self._post(job.on_error, e, job=job)
+            else:
+                if job.on_success:
+                    self._post(job.on_success, result, job=job)
+            finally:
+                _current_job.reset(token)
+                job.done = True
+                self._change_depth(-1)
+
+    def _change_depth(self, delta):
+        """更新队列深度并通知UI"""
+        with self._depth_lock:
+            self._depth += delta
+            depth = self._depth
+        if self.on_depth_change:
+            self._post(self.on_depth_change, depth)
+
+    def _post(self, callback, *args, job=None):
+        """将回调放入事件队列，由主线程执行；job 不再回调时丢弃"""
+        self._events.put((job, callback, args))
+
+    def _poll(self):
+        """在Tk主线程中处理工作线程发来的事件"""
+        if self._stopped:
+            return
+        while True:
+            try:
+                job, callback, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+            # 已取消或被取代的任务，结果不再更新界面
+            if job is not None and job.detached:
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"任务回调执行失败: {str(e)}")
+        self.root.after(self.poll_interval, self._poll)
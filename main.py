@@ -1,21 +1,32 @@
+import time
+
+# 记录启动时间，用于统计导入耗时和首个窗口出现的耗时
+_START_TIME = time.perf_counter()
+
 import tkinter as tk
-from PIL import ImageGrab
-import keyboard
 import os
 import sys
 
-from gemini_handler import GeminiHandler
-from image_processor import ImageProcessor
-from text_processor import TextProcessor
+from capture_pipeline import CapturePipeline
 from window_manager import WindowManager
 from ui_components import MainUI
+from job_queue import JobQueue, PRIORITY_FOREGROUND, PRIORITY_BACKGROUND
+from clipboard_watcher import ClipboardWatcher
+from metrics import Trace
 import config
 
+_IMPORT_TIME = time.perf_counter() - _START_TIME
+
 class TagSnap:
     def __init__(self):
         # 设置代理
         config.setup_proxy()
         
+        # 跟踪内存分配，供内存报告显示主要分配位置
+        if config.MEMORY_TRACEMALLOC:
+            import tracemalloc
+            tracemalloc.start()
+        
         # 初始化根窗口
         self.root = tk.Tk()
         
@@ -27,136 +38,263 @@ class TagSnap:
         
         # 设置窗口大小
         self.root.geometry(config.WINDOW_SIZE)
+        
+        # 主循环开始后统计启动耗时
+        self.root.after_idle(self.report_startup_time)
 
     def init_components(self):
         """初始化所有组件"""
-        # 初始化AI模型
-        self.gemini = GeminiHandler()
-        
-        # 初始化图片处理器
-        self.image_processor = ImageProcessor(config.IMAGE_NOTE_PATH)
-        
-        # 初始化文本处理器
-        self.text_processor = TextProcessor(config.TEXT_NOTE_PATH)
+        # 初始化处理流程
+        self.pipeline = CapturePipeline()
+        self.image_processor = self.pipeline.image_processor
         
         # 初始化UI
-        self.ui = MainUI(self.root, self.handle_paste)
+        self.ui = MainUI(self.root, self.handle_paste, self.cancel_current_job)
         
         # 初始化窗口管理器
         self.window_manager = WindowManager(
             self.root,
             show_callback=self.ui.show_window,
-            quit_callback=self.cleanup_and_exit
+            quit_callback=self.cleanup_and_exit,
+            stats_callback=self.show_metrics,
+            memory_callback=self.show_memory_report
         )
         
         # 设置UI的窗口管理器
         self.ui.set_window_manager(self.window_manager)
+        
+        # 点击状态栏查看性能统计
+        self.ui.status.bind('<Button-1>', lambda event: self.show_metrics())
+        
+        # 初始化后台任务队列
+        self.job_queue = JobQueue(
+            self.root,
+            worker_count=config.PIPELINE_WORKERS,
+            poll_interval=config.QUEUE_POLL_INTERVAL,
+            on_depth_change=self.ui.update_queue_depth
+        )
+        
+        # 最近一次粘贴的任务，只有它的结果会显示到界面
+        self.current_job = None
+        
+        # 后台重放上次未完成的捕获，网络恢复后继续重放
+        self.pipeline.start_journal_replay(config.JOURNAL_REPLAY_INTERVAL, config.get_proxy_address())
+        
+        # 剪贴板出现新图片时提前分析，粘贴时直接使用结果
+        self.clipboard_watcher = None
+        if config.CLIPBOARD_WATCH_ENABLED:
+            self.clipboard_watcher = ClipboardWatcher(
+                self.root,
+                self.pipeline.speculate_image,
+                interval=config.CLIPBOARD_WATCH_INTERVAL
+            )
+            self.clipboard_watcher.start()
+
+    def report_startup_time(self):
+        """报告导入耗时和首个窗口出现的耗时"""
+        self.root.update_idletasks()
+        self.startup_times = {
+            'import_ms': _IMPORT_TIME * 1000,
+            'first_window_ms': (time.perf_counter() - _START_TIME) * 1000
+        }
+        print(f"启动耗时：导入 {self.startup_times['import_ms']:.0f} ms，"
+              f"首个窗口 {self.startup_times['first_window_ms']:.0f} ms")
+        self.ui.update_status(f"就绪（启动耗时 {self.startup_times['first_window_ms']:.0f} ms）")
 
     def handle_paste(self):
         """处理粘贴事件"""
         try:
+            from PIL import ImageGrab
+            
             # 获取剪贴板内容
+            grab_start = time.perf_counter()
             clipboard_content = ImageGrab.grabclipboard()
             
             if clipboard_content:
                 # 处理图片
-                image = self.image_processor.process_clipboard_image(clipboard_content)
-                if image:
-                    self.process_image(image)
+                images = self.image_processor.process_clipboard_images(clipboard_content)
+                if len(images) > 1:
+                    # 多个文件作为一批处理，界面显示第一张
+                    self.ui.show_image(images[0])
+                    self.submit_capture(self.process_images, images, on_success=self.on_batch_processed,
+                                        on_cancel=self.release_images)
+                    return
+                if images:
+                    image = images[0]
+                    trace = Trace('image')
+                    trace.add('clipboard', (time.perf_counter() - grab_start) * 1000)
+                    
+                    # 先显示图片，耗时的保存和分析交给后台线程
+                    with trace.span('display'):
+                        self.ui.show_image(image)
+                    self.submit_capture(self.process_image, image, trace, on_success=self.on_image_processed,
+                                        on_cancel=self.release_image)
                     return
                     
             # 尝试获取文本
             try:
                 text = self.root.clipboard_get()
-                self.process_text(text)
             except tk.TclError:
                 self.ui.update_status("剪贴板内容无法识别")
+                return
+            
+            trace = Trace('text')
+            trace.add('clipboard', (time.perf_counter() - grab_start) * 1000)
+            self.submit_capture(self.process_text, text, trace, on_success=self.on_text_processed)
                 
         except Exception as e:
             self.ui.update_status(f"错误: {str(e)}")
 
-    def process_image(self, image):
-        """处理图片"""
-        try:
-            # 保存图片
-            save_info = self.image_processor.save_image(image)
-            
-            # 显示图片
-            self.ui.show_image(image)
-            
-            # 使用AI分析图片
-            analysis = self.gemini.analyze_image(image)
-            
-            # 创建markdown文件
-            self.image_processor.create_md_file(
-                save_info['md_path'],
-                save_info['relative_path'],
-                analysis['category'],
-                analysis['tags'],
-                analysis['summary']
-            )
-            
-            # 更新UI标签
-            self.ui.update_labels(
-                analysis['category'],
-                analysis['tags'],
-                analysis['summary']
-            )
-            
-            # 更新状态
-            self.ui.update_status(f"已保存为 {save_info['filename']}")
-            
-        except Exception as e:
-            self.ui.update_status(f"处理失败: {str(e)}")
+    def submit_capture(self, func, *args, on_success, on_cancel=None):
+        """提交一次粘贴的处理任务：之前的任务继续在后台写入笔记，但只有最新的任务会更新界面"""
+        if self.current_job:
+            # 被取代的任务降为后台优先级，当前显示的内容先处理
+            self.current_job.detach()
+            self.current_job.set_priority(PRIORITY_BACKGROUND)
+        self.current_job = self.job_queue.submit(
+            func, *args,
+            on_success=on_success,
+            on_error=self.on_process_failed,
+            on_progress=self.ui.update_status,
+            priority=PRIORITY_FOREGROUND,
+            on_cancel=on_cancel
+        )
+
+    def cancel_current_job(self):
+        """取消当前显示内容的处理：尚未发送的模型请求不再发送，结果不再显示"""
+        job = self.current_job
+        if job is None or job.done:
+            return
+        job.cancel()
+        self.current_job = None
+        self.ui.update_status("已取消")
 
-    def process_text(self, text):
-        """处理文本"""
+    def process_image(self, job, image, trace):
+        """处理图片（在后台线程中执行），保存和分析完成后释放原图"""
+        with image:
+            return self.pipeline.process_image(image, job.report, trace)
+
+    def process_images(self, job, images):
+        """批量处理多张图片（在后台线程中执行），完成后释放所有原图"""
         try:
-            # 处理原始文本
-            title = self.text_processor.process_source(text, self.text_processor.source_dir)
-            
-            # 使用AI分析文本
-            category = self.gemini.md_category_judge(text)
-            summary = self.gemini.md_summary_analyze(text)
-            tags = self.gemini.md_tag_analyze(text)
-            
-            # 生成新的markdown文件路径
-            md_filename = f"{title}.md"
-            md_path = os.path.join(config.TEXT_NOTE_PATH, md_filename)
-            
-            # 创建处理后的markdown文件
-            self.text_processor.create_md_file(
-                md_path,
-                title,
-                category.text,
-                tags.text,
-                summary.text
-            )
-            
-            # 构建显示文本
-            display_text = f"""标题：{title}
-分类：{category.text}
-标签：{tags.text}
+            return self.pipeline.process_images(images, job.report)
+        finally:
+            self.release_images(job, images)
+
+    def release_image(self, job, image, trace):
+        """图片任务开始前被取消时释放原图"""
+        image.close()
+
+    def release_images(self, job, images):
+        """批量任务开始前被取消时释放所有原图"""
+        for image in images:
+            image.close()
+
+    def process_text(self, job, text, trace):
+        """处理文本（在后台线程中执行），摘要边生成边显示"""
+        return self.pipeline.process_text(
+            text, job.report, trace,
+            on_summary_chunk=lambda chunk: job.post(self.ui.append_stream_text, chunk)
+        )
+
+    def show_metrics(self):
+        """显示各处理阶段最近的 p50/p95 耗时"""
+        from tkinter import messagebox
+        
+        if self.pipeline.metrics:
+            text = self.pipeline.metrics.format_summary()
+        else:
+            text = "性能统计未启用"
+        limiter_stats = self.pipeline.gemini.rate_limiter.stats()
+        text += f"\n限流等待：{limiter_stats['wait_seconds']:.1f}s，重试 {limiter_stats['retries']} 次"
+        messagebox.showinfo("性能统计", text, parent=self.root)
+
+    def show_memory_report(self):
+        """显示常驻内存和主要的内存分配位置"""
+        from tkinter import messagebox
+        import memory_report
+        
+        messagebox.showinfo("内存报告", memory_report.format_report(), parent=self.root)
+
+    def on_image_processed(self, result):
+        """图片处理完成后更新UI"""
+        analysis = result['analysis']
+        
+        # 更新UI标签
+        self.ui.update_labels(
+            analysis['category'],
+            analysis['tags'],
+            analysis['summary']
+        )
+        
+        # 更新状态
+        if result.get('duplicate'):
+            self.ui.update_status(f"与已有图片相似，已复用笔记 {result['filename']}")
+            return
+        
+        details = [
+            f"{result['format'].upper()} {result['bytes'] / 1024:.0f} KB",
+            f"编码 {result['encode_ms']:.0f} ms"
+        ]
+        if result['upload_bytes']:
+            details.append(f"上传 {result['upload_bytes'] / 1024:.0f} KB")
+        self.ui.update_status(f"已保存为 {result['filename']}（{'，'.join(details)}）")
+
+    def on_batch_processed(self, batch):
+        """批量处理完成后更新UI"""
+        results = batch['results']
+        duplicates = sum(1 for result in results if result.get('duplicate'))
+        categories = sorted({result['analysis']['category'] for result in results})
+        
+        self.ui.update_labels(
+            '、'.join(categories),
+            f"共 {len(results) + len(batch['failed'])} 张图片",
+            f"新建 {len(results) - duplicates} 篇笔记，复用 {duplicates} 篇，失败 {len(batch['failed'])} 张"
+        )
+        
+        status = f"批量处理完成：成功 {len(results)}，失败 {len(batch['failed'])}"
+        if batch['index_filename']:
+            status += f"，索引笔记 {batch['index_filename']}"
+        if batch['failed']:
+            status += f"（{batch['failed'][0][0]}: {batch['failed'][0][1]}）"
+        self.ui.update_status(status)
+
+    def on_text_processed(self, result):
+        """文本处理完成后更新UI"""
+        analysis = result['analysis']
+        
+        # 构建显示文本
+        display_text = f"""标题：{result['title']}
+分类：{analysis['category']}
+标签：{analysis['tags']}
 
 摘要：
-{summary.text}"""
-            
-            # 显示分析结果
-            self.ui.show_analysis_result(display_text)
-            
-            # 清空底部标签
-            self.ui.clear_labels()
-            
-            # 更新状态
-            self.ui.update_status(f"已保存为 {md_filename}")
-            
-        except Exception as e:
-            self.ui.update_status(f"处理失败: {str(e)}")
+{analysis['summary']}"""
+        
+        # 显示分析结果
+        self.ui.show_analysis_result(display_text)
+        
+        # 清空底部标签
+        self.ui.clear_labels()
+        
+        # 更新状态
+        self.ui.update_status(f"已保存为 {result['filename']}")
+
+    def on_process_failed(self, error):
+        """后台处理失败"""
+        self.ui.update_status(f"处理失败: {str(error)}")
 
     def cleanup_and_exit(self):
         """清理资源并退出"""
         try:
+            # 停止后台任务，等待正在写入的笔记完成后再关闭日志
+            if self.clipboard_watcher:
+                self.clipboard_watcher.stop()
+            self.job_queue.stop(timeout=config.SHUTDOWN_TIMEOUT)
+            self.pipeline.close(timeout=config.SHUTDOWN_TIMEOUT)
+            
             # 解除所有快捷键
+            import keyboard
             keyboard.unhook_all_hotkeys()
             
             # 销毁窗口
@@ -178,5 +316,9 @@ class TagSnap:
             self.cleanup_and_exit()
 
 if __name__ == "__main__":
+    # 打包后使用编码进程池需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     app = TagSnap()
     app.run() 
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import sys
+import tracemalloc
+
+# tracemalloc 自身的分配不计入报告
+_IGNORED_FILES = (tracemalloc.__file__,)
+
+
+def rss_bytes():
+    """返回当前进程的常驻内存（字节），无法获取时返回None"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if get_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    # 其他平台只能取得峰值
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def top_allocations(limit=10):
+    """返回 tracemalloc 统计的分配最多的代码位置 [(位置, 字节数, 块数)]，未开启跟踪时返回None"""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES]
+    )
+    return [
+        (f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size, stat.count)
+        for stat in snapshot.statistics('lineno')[:limit]
+    ]
+
+
+def format_report(limit=10):
+    """生成内存报告：常驻内存以及 tracemalloc 统计的主要分配位置"""
+    lines = []
+    rss = rss_bytes()
+    lines.append(f"常驻内存：{rss / 1024 / 1024:.1f} MB" if rss is not None else "常驻内存：无法获取")
+
+    allocations = top_allocations(limit)
+    if allocations is None:
+        # 首次查看时开始跟踪，之后的分配才会被记录
+        tracemalloc.start()
+        lines.append("已开始跟踪Python内存分配，稍后再次查看可得到分配最多的位置")
+        return '\n'.join(lines)
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"Python分配：当前 {current / 1024 / 1024:.1f} MB，峰值 {peak / 1024 / 1024:.1f} MB")
+    lines.append("分配最多的位置：")
+    for location, size, count in allocations:
+        lines.append(f"  {size / 1024:10.1f} KB {count:8d} 块  {os.path.basename(location)}")
+    return '\n'.join(lines)
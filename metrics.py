@@ -0,0 +1,200 @@
+import contextvars
+import json
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# 当前正在处理的捕获对应的Trace，TaskGraph提交任务时会复制上下文，模型请求线程也能取到
+_current_trace = contextvars.ContextVar('tagsnap_trace', default=None)
+
+
+class Trace:
+    """一次捕获的各阶段耗时和token用量"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.time()
+        self.stages = {}
+        self.tokens = defaultdict(int)
+        self.error = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, stage, ms):
+        """记录阶段耗时（毫秒），同名阶段累加"""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def add_tokens(self, usage):
+        """累加模型返回的 usage_metadata"""
+        if usage is None:
+            return
+        with self._lock:
+            for field in ('prompt_token_count', 'candidates_token_count', 'total_token_count'):
+                self.tokens[field] += getattr(usage, field, 0) or 0
+
+    @contextmanager
+    def span(self, stage):
+        """统计代码块耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def activate(self):
+        """将该Trace设为当前上下文的Trace"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'time': self.started,
+                'kind': self.kind,
+                'total_ms': round(self.total_ms(), 2),
+                'stages': {stage: round(ms, 2) for stage, ms in self.stages.items()},
+                'tokens': dict(self.tokens),
+                'error': self.error,
+            }
+
+
+def current_trace():
+    """返回当前上下文的Trace，没有时返回None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage):
+    """在当前Trace中统计代码块耗时，没有Trace时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+def _percentile(values, q):
+    """计算分位数"""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+class MetricsRecorder:
+    """把每次捕获的Trace追加到按大小轮转的JSONL日志，并维护最近若干次的p50/p95"""
+
+    def __init__(self, log_path, max_bytes=5 * 1024 * 1024, backup_count=3,
+                 prometheus_path=None, window=200):
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._token_totals = defaultdict(int)
+        self._count = 0
+
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    def record(self, trace):
+        """记录一次捕获"""
+        data = trace.to_dict()
+        line = json.dumps(data, ensure_ascii=False) + '\n'
+
+        with self._lock:
+            self._count += 1
+            self._samples[f"{data['kind']}.total"].append(data['total_ms'])
+            for stage, ms in data['stages'].items():
+                self._samples[stage].append(ms)
+            for field, count in data['tokens'].items():
+                self._token_totals[field] += count
+
+            try:
+                self._rotate_if_needed(len(line.encode('utf-8')))
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                if self.prometheus_path:
+                    self._write_prometheus()
+            except OSError as e:
+                print(f"性能日志写入失败: {str(e)}")
+
+    def _rotate_if_needed(self, incoming):
+        """日志超过大小上限时轮转为 .1 .2 ..."""
+        if not os.path.exists(self.log_path):
+            return
+        if os.path.getsize(self.log_path) + incoming <= self.max_bytes:
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.log_path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.log_path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.log_path, f"{self.log_path}.1")
+        else:
+            os.remove(self.log_path)
+
+    def summary(self):
+        """返回各阶段最近样本的 p50/p95（毫秒）"""
+        with self._lock:
+            return {
+                stage: {
+                    'count': len(values),
+                    'p50': _percentile(sorted(values), 50),
+                    'p95': _percentile(sorted(values), 95),
+                }
+                for stage, values in self._samples.items() if values
+            }
+
+    def format_summary(self):
+        """生成便于阅读的统计文本"""
+        summary = self.summary()
+        if not summary:
+            return "暂无性能数据"
+        lines = [f"{'阶段':<28}{'次数':>6}{'p50(ms)':>12}{'p95(ms)':>12}"]
+        for stage in sorted(summary):
+            item = summary[stage]
+            lines.append(f"{stage:<28}{item['count']:>6}{item['p50']:>12.1f}{item['p95']:>12.1f}")
+        with self._lock:
+            if self._token_totals:
+                tokens = "，".join(f"{field}={count}" for field, count in sorted(self._token_totals.items()))
+                lines.append(f"累计token：{tokens}")
+        return '\n'.join(lines)
+
+    def _write_prometheus(self):
+        """以Prometheus textfile格式写出统计（先写临时文件再替换，避免被读到半截内容）"""
+        lines = [
+            "# HELP tagsnap_stage_latency_ms Latency of capture pipeline stages.",
+            "# TYPE tagsnap_stage_latency_ms summary",
+        ]
+        for stage, values in self._samples.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            for quantile, q in (('0.5', 50), ('0.95', 95)):
+                lines.append(
+                    f'tagsnap_stage_latency_ms{{stage="{stage}",quantile="{quantile}"}} {_percentile(ordered, q):.3f}'
+                )
+            lines.append(f'tagsnap_stage_latency_ms_count{{stage="{stage}"}} {len(values)}')
+        lines.append("# HELP tagsnap_tokens_total Gemini tokens used.")
+        lines.append("# TYPE tagsnap_tokens_total counter")
+        for field, count in self._token_totals.items():
+            lines.append(f'tagsnap_tokens_total{{type="{field}"}} {count}')
+        lines.append("# TYPE tagsnap_captures_total counter")
+        lines.append(f"tagsnap_captures_total {self._count}")
+
+        tmp_path = self.prometheus_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prometheus_path)
@@ -0,0 +1,152 @@
+import asyncio
+import random
+import threading
+import time
+
+# 按HTTP状态码或异常类型判断可重试的错误（配额耗尽、服务暂时不可用等）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+    'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout',
+}
+
+# 一张图片按约5个768像素分块估算输入token
+IMAGE_TOKEN_ESTIMATE = 1290
+
+
+def estimate_tokens(contents):
+    """粗略估算请求的输入token数：ASCII约4字符1个token，中文等约1字符1个token"""
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    if isinstance(contents, str):
+        non_ascii = (len(contents.encode('utf-8')) - len(contents)) // 2
+        return (len(contents) - non_ascii) // 4 + non_ascii + 1
+    return IMAGE_TOKEN_ESTIMATE
+
+
+def is_retryable(error):
+    """判断错误是否值得退避后重试"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class TokenBucket:
+    """令牌桶，容量为每分钟配额，按配额速率匀速补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """预留令牌并返回需要等待的秒数，余额允许为负以保证先到先得"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """所有模型请求共用的限流器：请求数和token数双令牌桶，配额错误时指数退避"""
+
+    def __init__(self, requests_per_minute=15, tokens_per_minute=1000000,
+                 max_retries=5, base_delay=2.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._paused_until = 0.0
+
+        # 统计信息
+        self.request_count = 0
+        self.retry_count = 0
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, tokens=1):
+        """阻塞直到配额允许发出请求"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        """acquire 的协程版本，等待时不占用线程"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def call(self, func, tokens=1):
+        """在限流下执行请求，遇到配额或临时错误时带抖动地指数退避重试"""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                time.sleep(delay)
+
+    async def call_async(self, func, tokens=1):
+        """call 的协程版本，func 返回要等待的协程"""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            try:
+                return await func()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _reserve(self, tokens):
+        """预留一次请求的配额，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self._requests:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+            self.request_count += 1
+            if delay > 0:
+                self.wait_count += 1
+                self.wait_seconds += delay
+        return delay
+
+    def _backoff(self, attempt):
+        """计算第 attempt 次重试前的退避时间"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+
+        # 配额耗尽时暂停所有请求，避免其他线程继续触发429
+        with self._lock:
+            self.retry_count += 1
+            self.wait_count += 1
+            self.wait_seconds += delay
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self):
+        """返回限流统计信息"""
+        with self._lock:
+            return {
+                'requests': self.request_count,
+                'retries': self.retry_count,
+                'waits': self.wait_count,
+                'wait_seconds': self.wait_seconds
+            }
@@ -0,0 +1,227 @@
+"""重新分析：修改prompt或模型后，找出用旧版本生成的笔记，原地更新分类、标签和描述
+
+用法：python reanalyze.py [--workers 4] [--kind all|image|text] [--dry-run]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+
+def read_note(md_path):
+    """读取笔记，返回 (元数据行, 正文行)，没有元数据块时返回None"""
+    with open(md_path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+
+    if not lines or lines[0] != '---' or '---' not in lines[1:]:
+        return None
+    end = lines.index('---', 1)
+    return lines[1:end], lines[end + 1:]
+
+
+def parse_metadata(meta_lines):
+    """解析 key: value 形式的元数据"""
+    metadata = {}
+    for line in meta_lines:
+        key, sep, value = line.partition(':')
+        if sep:
+            metadata[key.strip()] = value.strip()
+    return metadata
+
+
+def note_kind(metadata, body):
+    """根据内容判断笔记类型：图片笔记正文以图片引用开头，文本笔记链接到原文；其他笔记返回None"""
+    if 'category' not in metadata:
+        return None
+    if body and body[0].startswith('![[') and body[0].endswith(']]'):
+        return 'image'
+    if metadata.get('link', '').strip('"').startswith(f"[[{config.SOURCE_SUBDIR}/"):
+        return 'text'
+    return None
+
+
+def find_stale_notes(pipeline, kinds):
+    """扫描笔记目录，返回prompt版本与当前不一致的 (类型, 路径) 列表"""
+    current = {
+        'image': pipeline.gemini.prompt_fingerprint('image'),
+        'text': pipeline.gemini.prompt_fingerprint('markdown'),
+    }
+
+    stale = []
+    for note_dir in sorted({os.path.abspath(config.IMAGE_NOTE_PATH), os.path.abspath(config.TEXT_NOTE_PATH)}):
+        if not os.path.isdir(note_dir):
+            continue
+        for filename in sorted(os.listdir(note_dir)):
+            path = os.path.join(note_dir, filename)
+            if not filename.endswith('.md') or not os.path.isfile(path):
+                continue
+            note = read_note(path)
+            if note is None:
+                continue
+            metadata = parse_metadata(note[0])
+            kind = note_kind(metadata, note[1])
+            if kind in kinds and metadata.get('prompt_hash') != current[kind]:
+                stale.append((kind, path))
+    return stale
+
+
+def analyze_note(pipeline, kind, md_path, metadata, body):
+    """重新分析笔记对应的图片或原文，返回 (分析结果, prompt版本)"""
+    from analysis_cache import image_cache_key, text_cache_key
+    note_dir = os.path.dirname(md_path)
+
+    if kind == 'image':
+        from PIL import Image
+        from image_processor import open_reduced
+
+        prompt_hash = pipeline.gemini.prompt_fingerprint('image')
+        with Image.open(os.path.join(note_dir, body[0][3:-2])) as image:
+            max_edge = pipeline.gemini.upload_max_edge
+            analysis_image = open_reduced(image, (max_edge, max_edge))
+            try:
+                analysis = pipeline.analyze_with_cache(
+                    pipeline.image_cache,
+                    image_cache_key(analysis_image, prompt_hash),
+                    lambda: pipeline.gemini.analyze_image(analysis_image)
+                )
+            finally:
+                if analysis_image is not image:
+                    analysis_image.close()
+        return analysis, prompt_hash
+
+    # 链接形如 "[[source/source_标题]]"，保存原文时标题中的 / 被替换为 _
+    source_name = metadata['link'].strip('"')[2:-2].split('/', 1)[1]
+    source_name = f"{source_name}.md".replace('/', '_')
+    # 与粘贴时一样分析原始文本；早期的笔记没有保存原始文本，改用去掉标题和元数据的原文
+    source_path = config.get_data_path(note_dir, os.path.join(config.ORIGINAL_SUBDIR, source_name))
+    if not os.path.exists(source_path):
+        source_path = os.path.join(note_dir, config.SOURCE_SUBDIR, source_name)
+    with open(source_path, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+
+    prompt_hash = pipeline.gemini.prompt_fingerprint('markdown')
+    analysis = pipeline.analyze_with_cache(
+        pipeline.text_cache,
+        text_cache_key(text, prompt_hash),
+        lambda: pipeline.gemini.analyze_text(text)
+    )
+    return analysis, prompt_hash
+
+
+def rewrite_note(md_path, meta_lines, body, kind, analysis, prompt_hash):
+    """只替换元数据中的分类、标签、prompt版本和正文中的描述，其余内容（创建日期、链接、图片引用等）保持不变"""
+    values = {
+        'category': analysis['category'],
+        'tags': analysis['tags'],
+        'prompt_hash': prompt_hash,
+    }
+
+    new_meta = []
+    for line in meta_lines:
+        key = line.partition(':')[0].strip()
+        if key in values:
+            new_meta.append(f"{key}: {values.pop(key)}")
+        else:
+            new_meta.append(line)
+    new_meta.extend(f"{key}: {value}" for key, value in values.items())
+
+    new_body = [body[0]] if kind == 'image' else []
+    new_body.append(analysis['summary'])
+
+    # 先写临时文件再替换，中断时不会留下写了一半的笔记
+    tmp_path = md_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(['---', *new_meta, '---', *new_body]))
+    os.replace(tmp_path, md_path)
+
+
+def reanalyze_note(pipeline, kind, md_path):
+    """重新分析一篇笔记并原地更新"""
+    meta_lines, body = read_note(md_path)
+    analysis, prompt_hash = analyze_note(pipeline, kind, md_path, parse_metadata(meta_lines), body)
+    rewrite_note(md_path, meta_lines, body, kind, analysis, prompt_hash)
+    return analysis['category']
+
+
+def run(workers, kinds, dry_run):
+    """执行重新分析，返回失败的笔记数"""
+    from capture_pipeline import CapturePipeline
+
+    config.setup_proxy()
+
+    # 关闭流程以释放日志、编码进程池和本次创建的上下文缓存
+    pipeline = CapturePipeline(sync_index=False)
+    try:
+        return reanalyze_all(pipeline, workers, kinds, dry_run)
+    finally:
+        pipeline.close()
+
+
+def reanalyze_all(pipeline, workers, kinds, dry_run):
+    """重新分析所有过期的笔记，返回失败的笔记数"""
+    notes = find_stale_notes(pipeline, kinds)
+    total = len(notes)
+    print(f"需要重新分析 {total} 篇笔记（图片 {sum(1 for kind, _ in notes if kind == 'image')}，"
+          f"文本 {sum(1 for kind, _ in notes if kind == 'text')}）")
+    if dry_run:
+        for kind, path in notes:
+            print(f"  {kind} {path}")
+        return 0
+    if not total:
+        return 0
+
+    counts = {'updated': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    # 模型请求仍受GeminiHandler的并发数和限流约束
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(reanalyze_note, pipeline, kind, path): path
+            for kind, path in notes
+        }
+        for finished, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                status, detail = 'updated', future.result()
+            except Exception as e:
+                status, detail = 'failed', str(e)
+            counts[status] += 1
+
+            elapsed = time.perf_counter() - start
+            remaining = elapsed / finished * (total - finished)
+            print(f"[{finished}/{total}] {status} {path} -> {detail}"
+                  f"（已用 {elapsed:.0f}s，剩余约 {remaining:.0f}s）")
+    except KeyboardInterrupt:
+        # 已更新的笔记记录了新的prompt版本，再次运行只会处理剩余的笔记
+        executor.shutdown(wait=True, cancel_futures=True)
+        print("已中断，再次运行将继续处理剩余的笔记")
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    print(f"完成：更新 {counts['updated']}，失败 {counts['failed']}")
+    limiter_stats = pipeline.gemini.rate_limiter.stats()
+    print(f"模型请求 {limiter_stats['requests']} 次，重试 {limiter_stats['retries']} 次，"
+          f"限流等待 {limiter_stats['wait_seconds']:.1f}s")
+    return counts['failed']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="prompt或模型修改后，重新分析用旧版本生成的笔记")
+    parser.add_argument('--workers', type=int, default=config.PIPELINE_WORKERS,
+                        help="同时处理的笔记数")
+    parser.add_argument('--kind', choices=['all', 'image', 'text'], default='all',
+                        help="只处理某一类笔记")
+    parser.add_argument('--dry-run', action='store_true', help="只列出需要重新分析的笔记")
+    args = parser.parse_args(argv)
+
+    kinds = {'image', 'text'} if args.kind == 'all' else {args.kind}
+    failed = run(max(1, args.workers), kinds, args.dry_run)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
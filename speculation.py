@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SpeculativeResults:
+    """按内容键保存提前开始的分析任务：粘贴时取出使用，超过TTL仍未被取用的结果丢弃"""
+
+    def __init__(self, ttl=300, max_entries=8, take_wait=5.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.take_wait = take_wait
+        # 预分析按剪贴板变化的顺序逐个执行，模型请求的并发由GeminiHandler控制；
+        # 解码和登记在 executor 中进行，模型请求在单独的线程中等待，粘贴时只需等待登记
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Speculate")
+        self.analysis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SpeculateAnalyze")
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # 已提交但尚未登记（或已结束）的预分析数，take 会等它们登记后再查找
+        self._preparing = 0
+        self._local = threading.local()
+        self._closed = False
+
+    def submit(self, func, *args):
+        """在预分析线程中执行 func，执行到 start() 登记结果或结束之前，take 会等待它"""
+        with self._lock:
+            self._preparing += 1
+
+        def run():
+            self._local.preparing = True
+            try:
+                func(*args)
+            finally:
+                self._prepared()
+
+        return self.executor.submit(run)
+
+    def _prepared(self):
+        """当前预分析已登记或已结束，唤醒等待的 take"""
+        if not getattr(self._local, 'preparing', False):
+            return
+        self._local.preparing = False
+        with self._lock:
+            self._preparing -= 1
+            self._changed.notify_all()
+
+    def start(self, key):
+        """登记一个进行中的预分析并返回对应的Future，同一内容已登记时返回None"""
+        with self._lock:
+            self._purge()
+            if key in self._entries:
+                future = None
+            else:
+                future = Future()
+                self._entries[key] = [None, future]
+                # 超出数量上限时丢弃最早的结果
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        self._prepared()
+        if future is not None:
+            future.add_done_callback(lambda _: self._set_deadline(key, future))
+        return future
+
+    def run(self, future, func, *args):
+        """在分析线程中执行 func，结果或异常设置到 start() 返回的 future"""
+        def run():
+            try:
+                result = func(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        try:
+            self.analysis_executor.submit(run)
+        except RuntimeError as e:
+            # 已关闭
+            future.set_exception(e)
+
+    def take(self, key):
+        """取出内容对应的预分析Future，没有时返回None；有已提交但尚未登记的预分析时先等待其登记"""
+        with self._lock:
+            if key not in self._entries:
+                self._changed.wait_for(
+                    lambda: self._closed or key in self._entries or self._preparing == 0,
+                    timeout=self.take_wait
+                )
+            self._purge()
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def close(self):
+        """停止预分析线程并丢弃所有结果"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.analysis_executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._closed = True
+            self._entries.clear()
+            self._changed.notify_all()
+
+    def _set_deadline(self, key, future):
+        """分析完成后开始计算TTL"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] is future:
+                entry[0] = time.monotonic() + self.ttl
+
+    def _purge(self):
+        """丢弃已过期的结果（调用方需持有锁）"""
+        now = time.monotonic()
+        for key in [key for key, (deadline, _) in self._entries.items() if deadline is not None and deadline < now]:
+            del self._entries[key]
@@ -0,0 +1,45 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class TaskGraph:
+    """按依赖关系并发执行任务：依赖全部完成的任务立即提交到线程池"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._tasks = {}
+
+    def add(self, name, func, *deps):
+        """添加任务，func 按 deps 的顺序接收依赖任务的结果"""
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"未知的依赖任务: {dep}")
+        self._tasks[name] = (func, deps)
+
+    def run(self):
+        """执行所有任务并返回 {任务名: 结果}"""
+        results = {}
+        pending = dict(self._tasks)
+        running = {}
+
+        try:
+            while pending or running:
+                # 提交所有依赖已满足的任务
+                for name, (func, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        args = [results[dep] for dep in deps]
+                        # 复制调用方的上下文，使任务线程能取到当前的性能Trace
+                        context = contextvars.copy_context()
+                        running[self.executor.submit(context.run, func, *args)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+        finally:
+            # 出错时取消尚未开始的任务
+            for future in running:
+                future.cancel()
+
+        return results
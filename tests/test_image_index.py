@@ -0,0 +1,68 @@
+"""相似图片索引的测试：文字截图之间感知哈希接近，不能因此被当作重复图片"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from analysis_cache import image_digest
+from image_index import ImageIndex, dhash
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def make_text_page(seed):
+    """生成白底黑字的文档截图，不同 seed 的文字内容不同"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (1280, 800), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1280, 40), fill=(50, 80, 160))
+    for y in range(60, 780, 22):
+        draw.text((40, y), " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 14))), fill='black')
+    return image
+
+
+def file_digest(path):
+    with Image.open(path) as image:
+        return image_digest(image)
+
+
+class ImageIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.images_dir = os.path.join(self.temp_dir.name, "images")
+        os.makedirs(self.images_dir)
+        self.index = ImageIndex(
+            self.images_dir,
+            os.path.join(self.temp_dir.name, ".tagsnap", "image_index.db"),
+            file_digest=file_digest
+        )
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(self.index._conn.close)
+
+    def save(self, image, filename):
+        image.save(os.path.join(self.images_dir, filename))
+        return filename
+
+    def test_different_text_pages_are_not_duplicates(self):
+        first, second = make_text_page(1), make_text_page(2)
+        self.index.add(self.save(first, "first.png"), dhash(first), image_digest(first))
+
+        self.assertIsNone(self.index.find(dhash(second), image_digest(second)))
+        self.assertEqual(self.index.find(dhash(first), image_digest(first)), "first.png")
+
+    def test_synced_image_is_confirmed_by_file_content(self):
+        first, second = make_text_page(1), make_text_page(2)
+        self.save(first, "first.png")
+        self.index.sync()
+
+        self.assertIsNone(self.index.find(dhash(second), image_digest(second)))
+        self.assertEqual(self.index.find(dhash(first), image_digest(first)), "first.png")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import re
+
+from rate_limiter import estimate_tokens
+
+_HEADING = re.compile(r'^#{1,6}\s', re.MULTILINE)
+
+
+def split_sections(md_text):
+    """按markdown标题拆分为若干节，每节以标题行开头（第一节可能没有标题）"""
+    starts = [match.start() for match in _HEADING.finditer(md_text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(md_text))
+    return [md_text[a:b] for a, b in zip(starts, starts[1:]) if md_text[a:b].strip()]
+
+
+def _split_oversized(section, max_tokens):
+    """没有子标题可拆的超长小节，按段落再按行拆分"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for paragraph in re.split(r'(?<=\n\n)', section):
+        # 单个段落仍然过长时按行拆
+        parts = [paragraph] if estimate_tokens(paragraph) <= max_tokens else paragraph.splitlines(keepends=True)
+        for part in parts:
+            tokens = estimate_tokens(part)
+            if current and current_tokens + tokens > max_tokens:
+                pieces.append(''.join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += tokens
+    if current:
+        pieces.append(''.join(current))
+    return pieces
+
+
+def split_markdown(md_text, max_tokens):
+    """沿标题边界把长文本拆成不超过 max_tokens（估算）的若干块，相邻的小节会合并"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for section in split_sections(md_text):
+        tokens = estimate_tokens(section)
+        pieces = [section] if tokens <= max_tokens else _split_oversized(section, max_tokens)
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append(''.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
@@ -5,82 +5,136 @@ import uuid
 import datetime
 import config
 
+# 标题行：去掉首尾空白后以 "# " 开头
+_TITLE_LINE = re.compile(r'\s*# .*\S')
+# 元数据块中的 tags 和 source 字段
+_META_KEY = re.compile(r'\s*(tags|source):')
+# 写入文件时每次切片的字符数
+WRITE_SLICE_CHARS = 64 * 1024
+
+
+def _iter_lines(text):
+    """逐行返回 (起始位置, 结束位置)，不复制文本"""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield start, len(text)
+            return
+        yield start, end
+        start = end + 1
+
+
+def _write_slices(f, text, start, end):
+    """将 text[start:end] 分片写入文件"""
+    for pos in range(start, end, WRITE_SLICE_CHARS):
+        f.write(text[pos:min(pos + WRITE_SLICE_CHARS, end)])
+
+
 class TextProcessor:
     def __init__(self, note_dir):
         self.note_dir = note_dir
         self.source_dir = os.path.join(note_dir, config.SOURCE_SUBDIR)
+        self.original_dir = config.get_data_path(note_dir, config.ORIGINAL_SUBDIR)
         os.makedirs(self.source_dir, exist_ok=True)
+        os.makedirs(self.original_dir, exist_ok=True)
 
-    def process_source(self, md_text, source_dir):
-        # 提取标题
+    @staticmethod
+    def find_title(md_text):
+        """查找标题行，返回 (标题, 行起始位置, 行结束位置)，未找到时返回 (None, None, None)"""
+        for start, end in _iter_lines(md_text):
+            if _TITLE_LINE.match(md_text, start, end):
+                return md_text[start:end].strip().lstrip('# ').strip(), start, end
+        return None, None, None
+
+    @staticmethod
+    def scan_source(md_text):
+        """单次扫描找出标题行和元数据块中tags到source之间的内容，返回 (标题, 需要删除的区间列表)"""
         title = None
-        title_line_index = None
-        lines = md_text.split('\n')
-        
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped.startswith('# '):
-                title = stripped.lstrip('# ').strip()
-                title_line_index = i
+        removed = []
+        # 元数据块的扫描状态：index 为删除标题行后的行号
+        index = 0
+        meta_done = False
+        tags_start = None
+        source_start = None
+
+        for start, end in _iter_lines(md_text):
+            if title is None and _TITLE_LINE.match(md_text, start, end):
+                title = md_text[start:end].strip().lstrip('# ').strip()
+                # 删除标题行及其换行符，标题位于最后一行时删除前面的换行符
+                if end < len(md_text):
+                    removed.append((start, end + 1))
+                else:
+                    removed.append((max(start - 1, 0), end))
+                if meta_done:
+                    break
+                continue
+
+            if not meta_done:
+                if index == 0:
+                    # 元数据块必须位于正文开头
+                    meta_done = end - start != 3 or not md_text.startswith('---', start)
+                elif index >= 2 and md_text.startswith('---', start):
+                    # 元数据块结束
+                    meta_done = True
+                    if source_start is not None:
+                        removed.append((tags_start, source_start))
+                elif source_start is None:
+                    key = _META_KEY.match(md_text, start, end)
+                    if key and key.group(1) == 'tags':
+                        tags_start = start
+                    elif key and tags_start is not None:
+                        source_start = start
+                index += 1
+
+            if meta_done and title is not None:
                 break
-                
+
+        removed.sort()
+        return title, removed
+
+    @staticmethod
+    def get_source_path(title, source_dir):
+        """获取原文的保存路径"""
+        filename = f"source_{title}.md".replace('/', '_')  # 处理可能存在的非法字符
+        return os.path.join(source_dir, filename)
+
+    def process_source(self, md_text, source_dir):
+        # 提取标题和需要删除的内容
+        title, removed = self.scan_source(md_text)
+
         if not title:
             raise ValueError("未找到标题行（以#开头的行）")
-            
-        # 删除标题行
-        if title_line_index is not None:
-            del lines[title_line_index]
-            md_text = '\n'.join(lines)
-            
-        # 处理元数据块
-        processed_text = md_text
-        metadata_match = re.search(r'^---\n(.*?)\n---', md_text, re.DOTALL)
-        
-        if metadata_match:
-            metadata_block = metadata_match.group(1)
-            metadata_lines = metadata_block.split('\n')
-            
-            tags_idx = None
-            source_idx = None
-            
-            # 查找tags和source的位置
-            for i, line in enumerate(metadata_lines):
-                line = line.strip()
-                if line.startswith('tags:'):
-                    tags_idx = i
-                if line.startswith('source:') and tags_idx is not None:
-                    source_idx = i
-                    break
-            
-            # 删除tags到source之间的内容
-            if tags_idx is not None and source_idx is not None and tags_idx < source_idx:
-                del metadata_lines[tags_idx:source_idx]
-                new_metadata = '\n'.join(metadata_lines)
-                processed_text = re.sub(
-                    r'^---\n.*?\n---',
-                    f'---\n{new_metadata}\n---',
-                    md_text,
-                    flags=re.DOTALL
-                )
-        
+
         # 生成文件名并保存
-        filename = f"source_{title}.md".replace('/', '_')  # 处理可能存在的非法字符
-        output_path = os.path.join(source_dir, filename)
-        
+        output_path = self.get_source_path(title, source_dir)
+
+        # 跳过删除的区间，其余内容分片直接写入文件，不生成处理后的完整文本
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(processed_text)
-        
+            pos = 0
+            for start, end in removed:
+                _write_slices(f, md_text, pos, start)
+                pos = max(pos, end)
+            _write_slices(f, md_text, pos, len(md_text))
+
+        # 模型分析的是粘贴的原文，另存一份供重新分析时使用
+        with open(self.get_source_path(title, self.original_dir), 'w', encoding='utf-8', newline='') as f:
+            _write_slices(f, md_text, 0, len(md_text))
+
         return title
 
-    def create_md_file(self, md_path, md_title, category, tags, summary):
-        """创建markdown文件"""
+    def create_md_file(self, md_path, md_title, category, tags, summary, prompt_hash=None):
+        """创建markdown文件，prompt_hash 为生成时的prompt和模型版本"""
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
         
+        # 记录prompt和模型版本，prompt修改后可据此找出需要重新分析的笔记
+        version_line = f"\nprompt_hash: {prompt_hash}" if prompt_hash else ""
+        
         md_content = f"""---
 category: {category}
 tags: {tags}
 created: {current_date}
-link: "[[source/source_{md_title}]]"
+link: "[[source/source_{md_title}]]"{version_line}
 ---
 {summary}"""
         
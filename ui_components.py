@@ -1,17 +1,20 @@
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk, ImageGrab
-import keyboard
+import config
 
 class MainUI:
-    def __init__(self, root, on_paste_callback):
+    def __init__(self, root, on_paste_callback, on_cancel_callback=None):
         self.root = root
         self.root.title("TagSnap")
         self.image_reference = None
-        self.current_image = None
+        self.image_size = None  # 原图尺寸，界面不保留原图
+        self.display_base = None  # 缩小后的显示底图
+        self.display_size = None  # 当前清晰渲染的尺寸
+        self._resize_job = None
         self.current_display = None  # 用于跟踪当前显示的内容类型
         self._exiting = False
         self.on_paste_callback = on_paste_callback
+        self.on_cancel_callback = on_cancel_callback
 
         # 设置图标
         try:
@@ -25,6 +28,9 @@ class MainUI:
         # 绑定快捷键
         self.setup_shortcuts()
         
+        # 全局快捷键在窗口显示后再注册，避免拖慢启动
+        self.root.after_idle(self.setup_global_hotkey)
+        
         # 设置窗口大小
         self.root.geometry("800x600")
         
@@ -56,8 +62,15 @@ class MainUI:
         self.text_area.pack_forget()  # 初始隐藏
 
         # 状态栏
-        self.status = ttk.Label(self.root, text="就绪", foreground="gray")
-        self.status.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_frame = ttk.Frame(self.root)
+        self.status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        self.status = ttk.Label(self.status_frame, text="就绪", foreground="gray")
+        self.status.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # 队列深度显示
+        self.queue_label = ttk.Label(self.status_frame, text="", foreground="gray")
+        self.queue_label.pack(side=tk.RIGHT, padx=5)
 
         # 标签框架
         self.labels_frame = ttk.Frame(self.root)
@@ -83,6 +96,11 @@ class MainUI:
         """设置快捷键"""
         self.root.bind('<Control-v>', self.paste_content)
         self.root.bind('<Command-v>', self.paste_content)
+        self.root.bind('<Escape>', self.cancel_current)
+
+    def setup_global_hotkey(self):
+        """注册全局快捷键"""
+        import keyboard
         keyboard.add_hotkey('ctrl+shift+z', lambda: self.window_manager.show_window() if hasattr(self, 'window_manager') else self.show_window)
 
     def set_window_manager(self, window_manager):
@@ -97,6 +115,14 @@ class MainUI:
         if self.on_paste_callback:
             self.on_paste_callback()
 
+    def cancel_current(self, event=None):
+        """取消当前显示内容的处理"""
+        if self._exiting:
+            return
+            
+        if self.on_cancel_callback:
+            self.on_cancel_callback()
+
     def show_text(self, text):
         """显示文本内容"""
         # 隐藏图片显示区域
@@ -154,48 +180,106 @@ class MainUI:
         
         self.update_status("分析结果已显示")
 
+    def append_stream_text(self, chunk):
+        """追加流式生成的摘要片段，chunk 为 None 时清空已显示的片段"""
+        if self._exiting or not self.text_area.winfo_exists():
+            return
+        
+        # 第一段到达时切换到文本区域
+        if self.current_display != 'stream' or chunk is None:
+            self.image_label.pack_forget()
+            self.text_area.pack(expand=True, fill='both')
+            self.text_area.configure(state='normal')
+            self.text_area.delete('1.0', tk.END)
+            self.text_area.insert('1.0', "摘要：\n")
+            self.text_area.configure(state='disabled')
+            self.current_display = 'stream'
+            if chunk is None:
+                return
+        
+        self.text_area.configure(state='normal')
+        self.text_area.insert(tk.END, chunk)
+        self.text_area.configure(state='disabled')
+        self.text_area.see(tk.END)
+
     def show_image(self, image):
         """显示图片"""
         if self._exiting or not self.image_label.winfo_exists():
             return
             
+        self.image_size = image.size
+        self.display_base = self._create_display_base(image)
+        self.display_size = None
+        
+        # 隐藏文本区域
+        self.text_area.pack_forget()
+        
+        # 显示图片区域
+        self.image_label.pack(expand=True)
+        
+        # 标记当前显示的是图片
+        self.current_display = 'image'
+        
+        self.render_image(sharp=True)
+
+    def _create_display_base(self, image):
+        """生成用于显示的缩小底图，尺寸不小于屏幕上可能的最大显示区域"""
+        from image_processor import open_reduced
+        
+        max_width = self.root.winfo_screenwidth() * config.DISPLAY_RATIO
+        max_height = self.root.winfo_screenheight() * config.DISPLAY_RATIO
+        
+        # 来自文件的JPEG按接近显示尺寸的比例解码
+        source = image
+        image = open_reduced(image, (max_width, max_height))
+        
+        # reduce 按整数倍做盒式缩小，速度远快于对原图直接做LANCZOS
+        factor = int(min(image.width / max_width, image.height / max_height))
+        if factor <= 1:
+            # 原图不大时复制一份，使原图处理完后可以关闭
+            return image.copy() if image is source else image
+        if image.mode in ('P', '1'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        return image.reduce(factor)
+
+    def render_image(self, sharp=True):
+        """按当前窗口大小渲染图片，sharp 为 False 时使用快速缩放"""
+        from PIL import Image, ImageTk
+        
+        if self._exiting or self.display_base is None:
+            return
+        
         try:
-            self.current_image = image
-            
-            # 隐藏文本区域
-            self.text_area.pack_forget()
-            
-            # 显示图片区域
-            self.image_label.pack(expand=True)
-            
             # 获取窗口大小
             window_width = self.root.winfo_width()
             window_height = self.root.winfo_height()
             
             # 设置显示尺寸为窗口大小的62%
-            display_width = int(window_width * 0.62)
-            display_height = int(window_height * 0.62)
+            display_width = int(window_width * config.DISPLAY_RATIO)
+            display_height = int(window_height * config.DISPLAY_RATIO)
             
             # 计算缩放比例
-            img_width, img_height = image.size
+            img_width, img_height = self.image_size
             width_ratio = display_width / img_width
             height_ratio = display_height / img_height
             ratio = min(width_ratio, height_ratio)
             
             # 计算新的尺寸
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
+            new_size = (max(1, int(img_width * ratio)), max(1, int(img_height * ratio)))
+            if new_size == self.display_size:
+                return
             
             # 调整图片大小
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            resample = Image.Resampling.LANCZOS if sharp else Image.Resampling.BILINEAR
+            resized_image = self.display_base.resize(new_size, resample)
             
             # 创建PhotoImage并显示
             tk_image = ImageTk.PhotoImage(resized_image)
             self.image_label.config(image=tk_image)
             self.image_reference = tk_image
             
-            # 标记当前显示的是图片
-            self.current_display = 'image'
+            # 快速渲染的结果不记录尺寸，以便稳定后重新做清晰渲染
+            self.display_size = new_size if sharp else None
             
         except tk.TclError as e:
             if not self._exiting:
@@ -210,6 +294,15 @@ class MainUI:
         except tk.TclError:
             pass
 
+    def update_queue_depth(self, depth):
+        """更新队列中待处理任务数"""
+        if self._exiting or not self.queue_label.winfo_exists():
+            return
+        try:
+            self.queue_label.config(text=f"队列：{depth}" if depth else "")
+        except tk.TclError:
+            pass
+
     def update_labels(self, category, tags, summary):
         """更新标签内容"""
         self.category_label.config(text=f"分类：{category}")
@@ -217,12 +310,27 @@ class MainUI:
         self.hint_label.config(text=f"描述：{summary}")
 
     def on_window_resize(self, event):
-        """处理窗口大小变化"""
+        """处理窗口大小变化：拖动时快速缩放，停止后再做一次清晰渲染"""
         if self._exiting or not self.root.winfo_exists():
             return
+        # 子控件的Configure事件也会冒泡到根窗口，只处理根窗口自身
+        if event.widget is not self.root:
+            return
         # 只在当前显示的是图片时重新显示图片
-        if hasattr(self, 'current_image') and self.current_image and self.current_display == 'image':
-            self.show_image(self.current_image)
+        if self.display_base is None or self.current_display != 'image':
+            return
+        
+        self.render_image(sharp=False)
+        
+        if self._resize_job:
+            self.root.after_cancel(self._resize_job)
+        self._resize_job = self.root.after(config.RESIZE_DEBOUNCE_MS, self._on_resize_settled)
+
+    def _on_resize_settled(self):
+        """窗口大小稳定后做清晰渲染"""
+        self._resize_job = None
+        if self.current_display == 'image':
+            self.render_image(sharp=True)
 
     def show_window(self):
         """显示窗口"""
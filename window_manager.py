@@ -1,8 +1,6 @@
 import threading
 import ctypes
 from ctypes import wintypes
-import pystray
-from PIL import Image
 import time
 import tkinter as tk
 
@@ -30,10 +28,12 @@ def _pump_messages():
         ctypes.windll.user32.DispatchMessageW(ctypes.byref(msg))
 
 class WindowManager:
-    def __init__(self, root, show_callback, quit_callback):
+    def __init__(self, root, show_callback, quit_callback, stats_callback=None, memory_callback=None):
         self.root = root
         self.show_callback = show_callback
         self.quit_callback = quit_callback
+        self.stats_callback = stats_callback
+        self.memory_callback = memory_callback
         
         # 状态标记
         self._exiting = False
@@ -43,8 +43,7 @@ class WindowManager:
         self.icon_lock = threading.Lock()
         self.icon_visible = threading.Event()
         
-        # 创建托盘图标
-        self.create_tray_icon()
+        # 托盘图标在首次隐藏窗口时才创建，避免启动时导入pystray
         
         # 设置窗口关闭按钮行为
         self.root.protocol('WM_DELETE_WINDOW', self.safe_hide_window)
@@ -53,6 +52,9 @@ class WindowManager:
     def create_tray_icon(self):
         """创建系统托盘图标"""
         if self.icon is None:
+            import pystray
+            from PIL import Image
+            
             try:
                 image = Image.open('icon.png')
             except Exception:
@@ -60,6 +62,8 @@ class WindowManager:
                 
             menu = (
                 pystray.MenuItem("显示", self.show_window),
+                pystray.MenuItem("性能统计", self.show_stats),
+                pystray.MenuItem("内存报告", self.show_memory_report),
                 pystray.MenuItem("退出", self.quit_app)
             )
             self.icon = pystray.Icon("TagSnap", image, "TagSnap", menu)
@@ -176,6 +180,16 @@ class WindowManager:
             self.icon_running_event.clear()
             self._cleanup_icon_resources()
 
+    def show_stats(self):
+        """显示性能统计（托盘线程中调用，交给Tk主线程执行）"""
+        if self.stats_callback:
+            self.root.after_idle(self.stats_callback)
+
+    def show_memory_report(self):
+        """显示内存报告（托盘线程中调用，交给Tk主线程执行）"""
+        if self.memory_callback:
+            self.root.after_idle(self.memory_callback)
+
     def quit_app(self):
         """退出应用程序"""
         self._exiting = True